@@ -0,0 +1,129 @@
+# bench/fake_panel.py
+import html
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Set
+from urllib.parse import parse_qs, urlparse
+
+class PanelConfig:
+    def __init__(self, surveys: int = 5, captcha_every: int = 0, captcha_delay_ms: int = 0, latency_ms: int = 0):
+        self.surveys = surveys
+        self.captcha_every = captcha_every          # every n-th survey shows a captcha; 0 = never
+        self.captcha_delay_ms = captcha_delay_ms    # inject the captcha iframe after this delay (0 = in the HTML)
+        self.latency_ms = latency_ms                # added to every response
+
+LOGIN_PAGE = """<!doctype html><html><body>
+<form method="post" action="/login">
+  <input name="email" type="text"><input name="password" type="password">
+  <button type="submit">Войти</button>
+</form></body></html>"""
+
+CAPTCHA_IFRAME = '<iframe src="/recaptcha/api2/anchor?k=bench" title="reCAPTCHA" width="304" height="78"></iframe>'
+
+def _card(i: int) -> str:
+    return (
+        f'<div class="card"><div class="card-body">'
+        f'<h5>Опрос №{i}: {html.escape("бенчмарк")}</h5>'
+        f'<p>{10 + i} баллов · {5 + i % 10} минут</p>'
+        f'<button onclick="location.href=\'/survey/{i}\'">Пройти опрос</button>'
+        f'</div></div>'
+    )
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "FakePanel"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: str = "", headers: Optional[dict] = None):
+        if self.server.config.latency_ms:
+            time.sleep(self.server.config.latency_ms / 1000)
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _logged_in(self) -> bool:
+        cookie = self.headers.get("Cookie", "")
+        return any(part.strip().split("=", 1)[-1] in self.server.sessions
+                   for part in cookie.split(";") if part.strip().startswith("bench_session="))
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        cfg = self.server.config
+        if path == "/login":
+            self._send(200, LOGIN_PAGE)
+        elif path == "/surveys":
+            if not self._logged_in():
+                self._send(302, headers={"Location": "/login"})
+                return
+            cards = "".join(_card(i) for i in range(1, cfg.surveys + 1))
+            self._send(200, f"<!doctype html><html><body><div class=\"container\">{cards}</div></body></html>")
+        elif path.startswith("/survey/"):
+            try:
+                n = int(path.rsplit("/", 1)[1])
+            except ValueError:
+                self._send(404, "not found")
+                return
+            captcha = ""
+            if cfg.captcha_every and n % cfg.captcha_every == 0:
+                if cfg.captcha_delay_ms:
+                    captcha = (
+                        "<script>setTimeout(function(){document.body.insertAdjacentHTML('beforeend', "
+                        f"'{CAPTCHA_IFRAME}')}}, {cfg.captcha_delay_ms});</script>"
+                    )
+                else:
+                    captcha = CAPTCHA_IFRAME
+            self._send(200, f"<!doctype html><html><body><h1>Опрос №{n}</h1><p>Вопросы...</p>{captcha}</body></html>")
+        elif path.startswith("/recaptcha/"):
+            self._send(200, "<!doctype html><html><body><div style='width:300px;height:74px'>☐ Я не робот</div></body></html>")
+        else:
+            self._send(404, "not found")
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/login":
+            self._send(404, "not found")
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        if not form.get("email") or not form.get("password"):
+            self._send(200, LOGIN_PAGE)
+            return
+        token = uuid.uuid4().hex
+        self.server.sessions.add(token)
+        self._send(302, headers={"Location": "/surveys", "Set-Cookie": f"bench_session={token}; Path=/"})
+
+class FakePanel(ThreadingHTTPServer):
+    """Local stand-in for the survey panel with the markup get_available_surveys expects."""
+
+    daemon_threads = True
+
+    def __init__(self, config: PanelConfig, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _Handler)
+        self.config = config
+        self.sessions: Set[str] = set()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def handle_error(self, request, client_address):
+        # Chromium hangs up mid-response when the bot closes a page or navigates away; that is expected here
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-panel", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
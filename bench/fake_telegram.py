@@ -0,0 +1,148 @@
+# bench/fake_telegram.py
+import asyncio
+import email.parser
+import email.policy
+import itertools
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+            "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+def _decode(value: str) -> Any:
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+def _parse_body(content_type: str, body: bytes) -> Dict[str, Any]:
+    if content_type.startswith("multipart/form-data"):
+        msg = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body)
+        params = {}
+        for part in msg.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name and part.get_filename() is None:
+                params[name] = _decode(part.get_content())
+            elif name:
+                params[name] = f"<file {len(part.get_payload(decode=True) or b'')} bytes>"
+        return params
+    return {k: _decode(v[0]) for k, v in parse_qs(body.decode("utf-8")).items()}
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "FakeBotAPI"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        params = _parse_body(self.headers.get("Content-Type", ""), self.rfile.read(length))
+        method = self.path.rstrip("/").rsplit("/", 1)[-1]
+        result = self.server.handle(method, params)
+        data = json.dumps({"ok": True, "result": result}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST
+
+class FakeBotAPI(ThreadingHTTPServer):
+    """Minimal Bot API: getUpdates long polling fed by push_callback(), outgoing calls recorded."""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _Handler)
+        self.calls: List[Tuple[float, str, Dict[str, Any]]] = []
+        self._updates: List[Dict[str, Any]] = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1000)
+        self._cond = threading.Condition()
+        self._listeners: List[Tuple[Callable[[str, Dict[str, Any]], bool], asyncio.Future, asyncio.AbstractEventLoop]] = []
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/bot"
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-response (e.g. a cancelled long poll) are expected here
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-telegram", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._cond.notify_all()
+        self.shutdown()
+        self.server_close()
+
+    # ----- Simulated users -----
+    def push_callback(self, chat_id: int, data: str):
+        update = {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(time.monotonic_ns()),
+                "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+                "chat_instance": str(chat_id),
+                "data": data,
+                "message": self._message(chat_id, "Меню бота:"),
+            },
+        }
+        with self._cond:
+            self._updates.append(update)
+            self._cond.notify_all()
+
+    def expect(self, predicate: Callable[[str, Dict[str, Any]], bool]) -> asyncio.Future:
+        """Future resolved with (method, params) of the first outgoing call matching predicate."""
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        with self._cond:
+            self._listeners.append((predicate, fut, loop))
+        return fut
+
+    # ----- Bot API methods -----
+    def _message(self, chat_id: int, text: str = "") -> Dict[str, Any]:
+        return {"message_id": next(self._message_ids), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": text}
+
+    def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get("offset") or 0)
+        deadline = time.monotonic() + float(params.get("timeout") or 0)
+        with self._cond:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+            return list(self._updates)
+
+    def handle(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == "getUpdates":
+            return self._get_updates(params)
+        if method == "getMe":
+            return BOT_USER
+        self.calls.append((time.monotonic(), method, params))
+        with self._cond:
+            for item in list(self._listeners):
+                predicate, fut, loop = item
+                if predicate(method, params):
+                    self._listeners.remove(item)
+                    loop.call_soon_threadsafe(lambda f=fut: f.done() or f.set_result((method, params)))
+        if method in ("sendMessage", "sendPhoto", "sendDocument"):
+            return self._message(int(params.get("chat_id", 0)), params.get("text") or params.get("caption") or "")
+        if method == "editMessageText":
+            msg = self._message(int(params.get("chat_id", 0)), params.get("text", ""))
+            msg["message_id"] = int(params.get("message_id", msg["message_id"]))
+            return msg
+        return True
@@ -0,0 +1,234 @@
+# bench/run_bench.py
+"""Offline end-to-end benchmark: N simulated chats drive the real bot against local stand-ins.
+
+    python -m bench.run_bench --chats 10 --surveys 8 --captcha-every 4
+
+The survey panel (bench/fake_panel.py) and the Bot API (bench/fake_telegram.py) run in
+this process on 127.0.0.1, so nothing touches the real site or Telegram. Chromium is still
+launched through Playwright, exactly as in production.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+from bench.fake_panel import FakePanel, PanelConfig
+from bench.fake_telegram import FakeBotAPI
+
+BUSY_TEXT = "Задача уже выполняется."
+
+# Outgoing texts that end each simulated step successfully
+TERMINAL = {
+    "find": lambda t: t.startswith(("Найденные опросы", "Не найдено")),
+    "start_all": lambda t: t in ("Обработка опросов завершена.", "Опросы не найдены."),
+    "report": lambda t: t.startswith("📊"),
+}
+# Texts that end any step with an error; such steps are counted apart and kept out of latencies and throughput
+FAILED = ("Ошибка", "Не удалось войти", "Поиск отменён", "Задача была отменена", "Сейчас слишком много задач",
+          "У тебя ещё нет аккаунта", "Сначала добавь аккаунт")
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None   # no successful run of the step: null in the report rather than a misleading number
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered) + 0.5)) - 1))], 3)
+
+def _tree_rss() -> Dict[str, float]:
+    """RSS of this process and of all its descendants (Playwright driver, Chromium), in bytes."""
+    page = os.sysconf("SC_PAGE_SIZE")
+    children: Dict[int, List[int]] = {}
+    rss: Dict[int, int] = {}
+    names: Dict[int, str] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+            with open(f"/proc/{entry}/statm") as f:
+                rss[int(entry)] = int(f.read().split()[1]) * page
+        except (OSError, ValueError, IndexError):
+            continue
+        name = stat[stat.index("(") + 1:stat.rindex(")")]
+        ppid = int(stat[stat.rindex(")") + 2:].split()[1])
+        names[int(entry)] = name
+        children.setdefault(ppid, []).append(int(entry))
+    me = os.getpid()
+    total, chromes, stack = 0, 0, [me]
+    while stack:
+        pid = stack.pop()
+        total += rss.get(pid, 0)
+        if pid != me and "chrom" in names.get(pid, "").lower() and "--type=" not in _cmdline(pid):
+            chromes += 1
+        stack.extend(children.get(pid, []))
+    return {"self": rss.get(me, 0), "tree": total, "chromium": chromes}
+
+def _cmdline(pid: int) -> str:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return f.read().replace(b"\0", b" ").decode("utf-8", "replace")
+    except OSError:
+        return ""
+
+class Sampler:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.peak = {"self": 0, "tree": 0, "chromium": 0, "live_browsers": 0}
+
+    async def run(self, browser_pool):
+        while True:
+            sample = _tree_rss()
+            sample["live_browsers"] = browser_pool.live_browsers()
+            for k, v in sample.items():
+                self.peak[k] = max(self.peak[k], v)
+            await asyncio.sleep(self.interval)
+
+async def _auto_solve_captchas(api: FakeBotAPI, delay: float):
+    """Press "Я нажал капчу" for every captcha photo the bot sends."""
+    while True:
+        _, params = await api.expect(lambda m, p: m == "sendPhoto")
+        chat_id = int(params["chat_id"])
+        asyncio.get_running_loop().call_later(delay, api.push_callback, chat_id, "captcha_done")
+
+def _ends_step(step: str, text: str) -> bool:
+    return TERMINAL[step](text) or text.startswith(FAILED) or text == BUSY_TEXT
+
+async def _simulate_chat(api: FakeBotAPI, chat_id: int, steps: List[str], rounds: int, timeout: float,
+                         latencies: Dict[str, List[float]], failures: Dict[str, int], timeouts: Dict[str, int]):
+    for _ in range(rounds):
+        for step in steps:
+            started = time.perf_counter()
+            while True:
+                fut = api.expect(lambda m, p, step=step: m == "sendMessage" and int(p.get("chat_id", 0)) == chat_id
+                                 and _ends_step(step, p.get("text", "")))
+                api.push_callback(chat_id, step)
+                try:
+                    _, params = await asyncio.wait_for(fut, timeout)
+                except asyncio.TimeoutError:
+                    timeouts[step] += 1
+                    break
+                text = params.get("text", "")
+                if text == BUSY_TEXT:
+                    # The previous job of this chat is still releasing its browser context
+                    await asyncio.sleep(0.2)
+                    continue
+                if TERMINAL[step](text):
+                    latencies[step].append(time.perf_counter() - started)
+                else:
+                    failures[step] += 1
+                break
+
+async def run(args) -> Dict:
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    os.chdir(workdir)
+    panel = FakePanel(PanelConfig(args.surveys, args.captcha_every, args.captcha_delay_ms, args.panel_latency_ms))
+    api = FakeBotAPI()
+    panel.start()
+    api.start()
+    os.environ.update({
+        "PANEL_LOGIN_URL": f"{panel.base_url}/login",
+        "PANEL_SURVEYS_URL": f"{panel.base_url}/surveys",
+        "TELEGRAM_API_BASE_URL": api.base_url,
+        "MAX_BROWSER_JOBS": str(args.max_browser_jobs),
+    })
+
+    # Imported only now: these modules read their configuration from the environment
+    import bot_main
+    import browser_pool
+    import users_manager
+
+    chat_ids = [100000 + i for i in range(args.chats)]
+    for chat_id in chat_ids:
+        users_manager.add_or_update_user(chat_id, f"user{chat_id}@bench.local", "bench-password")
+
+    app = bot_main.build_application("123456:BENCH")
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.updater.start_polling(poll_interval=0.0, timeout=1)
+    await app.start()
+
+    sampler = Sampler(args.sample_interval)
+    background = [asyncio.create_task(sampler.run(browser_pool)),
+                  asyncio.create_task(_auto_solve_captchas(api, args.captcha_solve_ms / 1000))]
+    steps = args.steps.split(",")
+    latencies: Dict[str, List[float]] = {s: [] for s in steps}
+    failures: Dict[str, int] = {s: 0 for s in steps}
+    timeouts: Dict[str, int] = {s: 0 for s in steps}
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*[
+            _simulate_chat(api, chat_id, steps, args.rounds, args.step_timeout, latencies, failures, timeouts)
+            for chat_id in chat_ids
+        ])
+    finally:
+        elapsed = time.perf_counter() - started
+        for t in background:
+            t.cancel()
+        # Same order as Application.run_polling, so jobs cancelled at shutdown still reach the Bot API
+        await app.updater.stop()
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+        api.stop()
+        panel.stop()
+
+    completed = sum(len(v) for v in latencies.values())
+    api_calls: Dict[str, int] = {}
+    for _, method, _ in api.calls:
+        api_calls[method] = api_calls.get(method, 0) + 1
+    return {
+        "chats": args.chats,
+        "surveys_per_chat": args.surveys,
+        "elapsed_s": round(elapsed, 3),
+        # Successful steps only; failed ones are reported per step under "failures"
+        "throughput_steps_per_s": round(completed / elapsed, 3) if elapsed else 0,
+        "failed_steps": sum(failures.values()),
+        "steps": {
+            s: {"n": len(v), "failures": failures[s], "timeouts": timeouts[s],
+                "p50_s": _percentile(v, 0.50), "p95_s": _percentile(v, 0.95)}
+            for s, v in latencies.items()
+        },
+        "peak_rss_mb": {"bot": round(sampler.peak["self"] / 2**20, 1), "total": round(sampler.peak["tree"] / 2**20, 1)},
+        "peak_browsers": {"pool": sampler.peak["live_browsers"], "chromium_processes": sampler.peak["chromium"]},
+        "bot_api_calls": api_calls,
+        "workdir": workdir,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=5, help="simulated chats running concurrently")
+    parser.add_argument("--rounds", type=int, default=1, help="times each chat repeats the step sequence")
+    parser.add_argument("--steps", default="find,start_all,report", help="comma-separated callback data to press")
+    parser.add_argument("--surveys", type=int, default=5, help="surveys listed on the fake panel")
+    parser.add_argument("--captcha-every", type=int, default=0, help="every n-th survey shows a captcha (0 = none)")
+    parser.add_argument("--captcha-delay-ms", type=int, default=0, help="inject the captcha frame after a delay")
+    parser.add_argument("--captcha-solve-ms", type=int, default=500, help="simulated user reaction time")
+    parser.add_argument("--panel-latency-ms", type=int, default=0, help="added to every fake panel response")
+    parser.add_argument("--max-browser-jobs", type=int, default=3, help="MAX_BROWSER_JOBS for the run")
+    parser.add_argument("--step-timeout", type=float, default=300, help="seconds before a step counts as timed out")
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="RSS/browser sampling period (s)")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            f.write(text)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,15 @@
 # bot_main.py
+import time
+_STARTED = time.perf_counter()   # before the imports below, so the startup log includes them
+
+import io
 import os
+import sys
 import asyncio
+import tempfile
+import importlib
 import logging
+from typing import Optional, TYPE_CHECKING
 from telegram import (
     Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile, ReplyKeyboardRemove
 )
@@ -9,21 +17,65 @@ from telegram.ext import (
     ApplicationBuilder, CommandHandler, CallbackQueryHandler, ContextTypes,
     ConversationHandler, MessageHandler, filters
 )
-from web_automation_playwright import PlaywrightExpertBot
+import job_journal
+import metrics
+import scheduler
+import survey_cache
 import users_manager
+from outbox import MeasuredRequest, Outbox
+from update_processor import PerChatUpdateProcessor
+
+if TYPE_CHECKING:
+    from web_automation_playwright import PlaywrightExpertBot
+
+# Playwright, bs4 and the browser modules are imported lazily (see _prewarm) so polling starts first
+AUTOMATION_MODULE = "web_automation_playwright"
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# Bot API endpoint, e.g. a local Bot API server or the bench/ stand-in
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
 REPLIT_PREVIEW_URL = os.getenv("REPLIT_PREVIEW_URL", "https://<your-repl>.id.repl.co/")
+# Comma-separated chat ids allowed to use /stats
+ADMIN_CHAT_IDS = {int(x) for x in os.getenv("ADMIN_CHAT_IDS", "").replace(" ", "").split(",") if x}
+# "polling" (default) or "webhook": PTB's built-in HTTP listener receives updates Telegram posts to WEBHOOK_URL
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")               # public https base URL, e.g. https://bot.example.com
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None      # checked against X-Telegram-Bot-Api-Secret-Token
+# Updates of different chats processed at the same time (one chat's updates always run in order);
+# 1 restores strictly sequential handling
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "32"))
+# Records per /history page
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "10"))
+# Launch the Playwright driver and the first Chromium in the background right after startup
+BROWSER_PREWARM = os.getenv("BROWSER_PREWARM", "1").lower() in ("1", "true", "yes")
 
 # Conversation states for adding/editing account
 EMAIL, PASSWORD = range(2)
 
-_runner_task = {}
-_runner_lock = asyncio.Lock()
+_scheduler = scheduler.JobScheduler()   # per-chat browser jobs, bounded by MAX_BROWSER_JOBS
 _playbots = {}           # chat_id -> PlaywrightExpertBot instance
 _captcha_waiters = {}    # chat_id -> asyncio.Event
+_outbox: Optional[Outbox] = None   # rate-limited sender, created in post_init
+_metrics_server = None
+_prewarm_task: Optional[asyncio.Task] = None
+_resume_offer_task: Optional[asyncio.Task] = None
+
+def _live_browsers() -> int:
+    pool = sys.modules.get("browser_pool")
+    return pool.live_browsers() if pool else 0
+
+JOB_SECONDS = metrics.histogram("bot_job_seconds", "Wall time of browser jobs by kind, queueing excluded")
+STARTUP_SECONDS = metrics.gauge("bot_startup_seconds", "Seconds from process start until each startup phase finished")
+metrics.gauge("bot_live_browsers", "Connected Chromium processes in the browser pool", _live_browsers)
+metrics.gauge("bot_running_jobs", "Browser jobs currently running", lambda: _scheduler.running)
+metrics.gauge("bot_queued_jobs", "Browser jobs waiting for a slot", lambda: _scheduler.queued)
+metrics.gauge("bot_captcha_waiters", "Runners waiting for the user to solve a captcha", lambda: len(_captcha_waiters))
+metrics.gauge("bot_outbox_pending", "Bot API calls waiting in the outbox", lambda: _outbox.pending if _outbox else 0)
 
 async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
@@ -63,7 +115,8 @@ async def recv_password(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     password = update.message.text.strip()
     email = context.user_data.get("new_email")
-    users_manager.add_or_update_user(chat_id, email, password)
+    await users_manager.aadd_or_update_user(chat_id, email, password)
+    survey_cache.invalidate(chat_id)
     await update.message.reply_text("Аккаунт сохранён ✅\nТеперь можно в Меню нажать ▶ Начать опросы (авто).")
     return ConversationHandler.END
 
@@ -75,10 +128,32 @@ async def delete_account_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     chat_id = query.message.chat_id
-    users_manager.remove_user(chat_id)
+    if _scheduler.busy(chat_id):
+        # The running job would re-create the user with its next record
+        await query.edit_message_text("Сначала останови текущую задачу (кнопка «Отмена»).")
+        return
+    await users_manager.aremove_user(chat_id)
+    survey_cache.invalidate(chat_id)
     await query.edit_message_text("Аккаунт удалён (если он был).")
 
 # ----- Core bot callbacks -----
+def _format_surveys(surveys, age=None) -> str:
+    if not surveys:
+        return "Не найдено доступных опросов."
+    text = "Найденные опросы:\n"
+    for i, s in enumerate(surveys, start=1):
+        text += f"{i}. {s['title']} — {s['points']} баллов\n"
+    if age is not None:
+        text += f"\n(список обновлён {int(age)} с назад)"
+    return text
+
+# callback_data values handled by handle_callback; the rest have their own handlers
+MENU_CALLBACKS = r"^(find|start_all|resume|resume_discard|report|open_preview|captcha_done|cancel|back_main)$"
+
+async def stale_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Buttons from older bot versions: answer anyway so the client stops its spinner
+    await update.callback_query.answer("Кнопка устарела, нажми /start")
+
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -91,158 +166,422 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data == "report":
-        if not users_manager.has_credentials(chat_id):
-            await app.bot.send_message(chat_id=chat_id, text="У тебя ещё нет аккаунта. Добавь через Меню → Аккаунт.")
+        if not await users_manager.ahas_credentials(chat_id):
+            await _outbox.send_message(chat_id, "У тебя ещё нет аккаунта. Добавь через Меню → Аккаунт.")
             return
-        s = users_manager.summary(chat_id)
+        s = await users_manager.asummary(chat_id)
         text = f"📊 Статистика\n\nВсего опросов: {s['total_surveys']}\nЗаработано баллов: {s['total_points']}\n\nПоследние {len(s['last5'])}:\n"
         for r in s['last5']:
             text += f"• {r['points']} баллов — \"{r['title']}\" ({r['date']})\n"
-        await app.bot.send_message(chat_id=chat_id, text=text)
+        text += "\nВся история: /history, выгрузка в CSV: /export"
+        await _outbox.send_message(chat_id, text)
         return
 
     if data == "find":
-        if not users_manager.has_credentials(chat_id):
-            await app.bot.send_message(chat_id=chat_id, text="Сначала добавь аккаунт в Меню → Аккаунт.")
-            return
-        await query.edit_message_text("Ищу опросы... Подождите.")
-        u = users_manager.get_user(chat_id)
-        pb = PlaywrightExpertBot(u["email"], u["password"], headless=True)
-        await pb.start()
-        ok = await pb.login()
-        if not ok:
-            await app.bot.send_message(chat_id=chat_id, text="Ошибка входа — проверь email/password в разделе Аккаунт.")
-            await pb.stop()
+        creds = await users_manager.aget_credentials(chat_id)
+        if creds is None:
+            await _outbox.send_message(chat_id, "Сначала добавь аккаунт в Меню → Аккаунт.")
             return
-        surveys = await pb.get_available_surveys()
-        await pb.stop()
-        if not surveys:
-            await app.bot.send_message(chat_id=chat_id, text="Не найдено доступных опросов.")
+        surveys = survey_cache.get(chat_id)
+        if surveys is not None:
+            await _outbox.send_message(chat_id, _format_surveys(surveys, survey_cache.age(chat_id)))
             return
-        text = "Найденные опросы:\n"
-        for i, s in enumerate(surveys, start=1):
-            text += f"{i}. {s['title']} — {s['points']} баллов\n"
-        await app.bot.send_message(chat_id=chat_id, text=text)
+        pb = _new_playbot(chat_id, creds)
+        job = await _submit_job(chat_id, "find", lambda: _find_job(chat_id, pb))
+        if job and job.state == scheduler.RUNNING:
+            await query.edit_message_text("Ищу опросы... Подождите.")
         return
 
-    if data == "start_all":
-        if not users_manager.has_credentials(chat_id):
-            await app.bot.send_message(chat_id=chat_id, text="Сначала добавь аккаунт в Меню → Аккаунт.")
+    if data in ("start_all", "resume"):
+        creds = await users_manager.aget_credentials(chat_id)
+        if creds is None:
+            await _outbox.send_message(chat_id, "Сначала добавь аккаунт в Меню → Аккаунт.")
             return
-        async with _runner_lock:
-            if chat_id in _runner_task and not _runner_task[chat_id].done():
-                await app.bot.send_message(chat_id=chat_id, text="Задача уже выполняется.")
+        journal = None
+        if data == "resume":
+            journal = await job_journal.aload(chat_id)
+            if journal is None:
+                await _outbox.send_message(chat_id, "Нет прерванной задачи.")
                 return
-            u = users_manager.get_user(chat_id)
-            pb = PlaywrightExpertBot(u["email"], u["password"], headless=True)
-            task = asyncio.create_task(_runner_auto(chat_id, app, pb))
-            _runner_task[chat_id] = task
-            await app.bot.send_message(chat_id=chat_id, text="Запуск автоматического прохождения опросов...")
+        pb = _new_playbot(chat_id, creds)
+        job = await _submit_job(chat_id, "start_all", lambda: _runner_auto(chat_id, app, pb, journal))
+        if job and job.state == scheduler.RUNNING:
+            text = "Продолжаю с места остановки..." if journal else "Запуск автоматического прохождения опросов..."
+            await _outbox.send_message(chat_id, text)
+        return
+
+    if data == "resume_discard":
+        if _scheduler.busy(chat_id):
+            await _outbox.send_message(chat_id, "Задача уже выполняется.")
+            return
+        await job_journal.adiscard(chat_id)
+        await _outbox.send_message(chat_id, "Прогресс прерванной задачи сброшен.")
         return
 
     if data == "open_preview":
-        await app.bot.send_message(chat_id=chat_id, text=f"Открой превью Replit и нажми капчу:\n{REPLIT_PREVIEW_URL}")
+        await _outbox.send_message(chat_id, f"Открой превью Replit и нажми капчу:\n{REPLIT_PREVIEW_URL}")
         return
 
     if data == "captcha_done":
         ev = _captcha_waiters.get(chat_id)
         if ev:
             ev.set()
-            await app.bot.send_message(chat_id=chat_id, text="Принял — продолжаю выполнение.")
+            await _outbox.send_message(chat_id, "Принял — продолжаю выполнение.")
         else:
-            await app.bot.send_message(chat_id=chat_id, text="Нет ожидающей операции.")
+            await _outbox.send_message(chat_id, "Нет ожидающей операции.")
         return
 
     if data == "cancel":
-        async with _runner_lock:
-            t = _runner_task.get(chat_id)
-            if t and not t.done():
-                t.cancel()
-                await app.bot.send_message(chat_id=chat_id, text="Остановил текущую задачу.")
-            else:
-                await app.bot.send_message(chat_id=chat_id, text="Нечего останавливать.")
+        state = _scheduler.cancel(chat_id)
+        if state == scheduler.RUNNING:
+            await _outbox.send_message(chat_id, "Остановил текущую задачу.")
+        elif state == scheduler.QUEUED:
+            await _outbox.send_message(chat_id, "Задача убрана из очереди.")
+        else:
+            await _outbox.send_message(chat_id, "Нечего останавливать.")
         return
 
+# ----- Browser jobs (admitted through _scheduler) -----
+def _new_playbot(chat_id: int, creds: dict) -> "PlaywrightExpertBot":
+    # Usually already imported by _prewarm; otherwise the first job pays for the import here
+    automation = importlib.import_module(AUTOMATION_MODULE)
+    return automation.PlaywrightExpertBot(creds["email"], creds["password"], headless=True, session_key=str(chat_id))
+
+async def _submit_job(chat_id: int, kind: str, factory):
+    """Hand a browser job to the scheduler; tells the user when it is queued, busy or rejected."""
+    if _scheduler.busy(chat_id):
+        pos = _scheduler.position(chat_id)
+        text = f"Задача уже в очереди (позиция {pos})." if pos else "Задача уже выполняется."
+        await _outbox.send_message(chat_id, text)
+        return None
+
+    async def on_position(pos: int):
+        await _outbox.send_message(chat_id, f"Все браузеры заняты. Ваша позиция в очереди: {pos}.")
+
+    async def measured():
+        with metrics.timer(JOB_SECONDS, kind=kind), metrics.job_memory(kind):
+            await factory()
+
+    try:
+        return _scheduler.submit(chat_id, kind, measured, on_position=on_position)
+    except scheduler.QueueFull:
+        await _outbox.send_message(chat_id, "Сейчас слишком много задач, попробуй чуть позже.")
+        return None
+
+async def _find_job(chat_id: int, pb: "PlaywrightExpertBot"):
+    try:
+        await pb.start()
+        ok = await pb.login()
+        if not ok:
+            await _outbox.send_message(chat_id, "Ошибка входа — проверь email/password в разделе Аккаунт.")
+            return
+        surveys = await pb.get_available_surveys()
+        survey_cache.put(chat_id, surveys)
+        await _outbox.send_message(chat_id, _format_surveys(surveys))
+    except asyncio.CancelledError:
+        await _outbox.send_message(chat_id, "Поиск отменён.")
+    except Exception as e:
+        logging.exception("Find error: %s", e)
+        await _outbox.send_message(chat_id, f"Ошибка: {e}")
+    finally:
+        await pb.stop()
+
 # ----- Runner that processes all surveys for a given user -----
-async def _runner_auto(chat_id: int, app, pb: PlaywrightExpertBot):
+async def _offer_resume(chat_id: int, journal: job_journal.Journal, reason: str):
+    p = journal.progress()
+    kb = InlineKeyboardMarkup([[
+        InlineKeyboardButton("▶ Продолжить", callback_data="resume"),
+        InlineKeyboardButton("✖ Сбросить", callback_data="resume_discard"),
+    ]])
+    await _outbox.send_message(
+        chat_id,
+        f"{reason}\nПройдено {p['completed']}, пропущено {p['skipped']} из {p['total']}. Продолжить с места остановки?",
+        reply_markup=kb,
+    )
+
+async def _runner_auto(chat_id: int, app, pb: "PlaywrightExpertBot", journal: Optional[job_journal.Journal] = None):
+    # Progress goes into one message that is edited in place instead of a message per step
+    status = _outbox.status(chat_id)
+    resumed = journal is not None
+    progress_counts = journal.progress() if journal else {"completed": 0, "skipped": 0}
+    done, skipped = progress_counts["completed"], progress_counts["skipped"]
+    earned = 0
+    total = 0
+
+    def progress(line: str):
+        status.update(f"Опросы: {done}/{total} пройдено, пропущено {skipped}, баллов {earned}\n{line}")
+
     try:
         await pb.start()
         ok = await pb.login()
         if not ok:
-            await app.bot.send_message(chat_id=chat_id, text="Не удалось войти (проверь учётные данные).")
+            await _outbox.send_message(chat_id, "Не удалось войти (проверь учётные данные).")
             await pb.stop()
             return
 
-        surveys = await pb.get_available_surveys()
+        # Start from the journal snapshot or the list "find" just scanned; re-validated when a click fails
+        if resumed:
+            surveys = journal.surveys
+        else:
+            surveys = survey_cache.get(chat_id)
+        from_cache = bool(surveys)
+        if from_cache:
+            await pb.open_surveys_page()
+        else:
+            surveys = await pb.get_available_surveys()
+            survey_cache.put(chat_id, surveys)
         if not surveys:
-            await app.bot.send_message(chat_id=chat_id, text="Опросы не найдены.")
+            await job_journal.adiscard(chat_id)
+            await _outbox.send_message(chat_id, "Опросы не найдены.")
             await pb.stop()
             return
 
-        await app.bot.send_message(chat_id=chat_id, text=f"Найдено {len(surveys)} опросов. Начинаю проходить...")
-
-        for s in surveys:
+        if not resumed:
+            journal = job_journal.Journal(chat_id)
+            journal.set_surveys(surveys)
+            await journal.checkpoint()
+        total = len(journal.surveys)
+        progress(f"Найдено {total} опросов. Начинаю проходить...")
+
+        pending = journal.pending()
+        seen = {s.get("title") for s in journal.surveys if job_journal.survey_key(s) in journal.done_keys}
+        while pending:
+            s = pending.pop(0)
             title = s.get("title", "Опрос")
             points = s.get("points", 0)
-            await app.bot.send_message(chat_id=chat_id, text=f"→ Открываю: {title} ({points} баллов)")
+            seen.add(title)
+            journal.begin(s)
+            progress(f"→ Открываю: {title} ({points} баллов)")
             ok_click = await pb.open_survey_by_xpath(s["button_xpath"])
+            if not ok_click and from_cache:
+                # The cached list is stale: rescan once and continue with what is really there
+                from_cache = False
+                fresh = await pb.get_available_surveys()
+                survey_cache.put(chat_id, fresh)
+                s = next((f for f in fresh if f.get("title") == title), None)
+                pending = [f for f in fresh if f.get("title") not in seen]
+                journal.set_surveys(fresh)
+                total = len(journal.surveys)
+                ok_click = bool(s) and await pb.open_survey_by_xpath(s["button_xpath"])
+                if s:
+                    journal.begin(s)
             if not ok_click:
-                await app.bot.send_message(chat_id=chat_id, text=f"Ошибка при открытии опроса: {title}. Пропускаю.")
+                skipped += 1
+                if s:
+                    journal.skipped(s)
+                    await journal.checkpoint()
+                progress(f"Ошибка при открытии опроса: {title}. Пропускаю.")
                 continue
 
-            await asyncio.sleep(2)
-            has_captcha = await pb.check_captcha()
+            has_captcha = await pb.wait_for_captcha()
             if has_captcha:
-                screenshot_path = f"captcha_{chat_id}.png"
-                await pb.screenshot_captcha(screenshot_path)
+                journal.waiting_captcha()
+                await journal.checkpoint()
+                photo = io.BytesIO(await pb.screenshot_captcha())
+                photo.name = "captcha.jpg"
                 kb = InlineKeyboardMarkup([
                     [InlineKeyboardButton("🌐 Открыть окно браузера", callback_data="open_preview")],
                     [InlineKeyboardButton("👍 Я нажал капчу", callback_data="captcha_done"),
                      InlineKeyboardButton("❌ Отмена", callback_data="cancel")]
                 ])
-                with open(screenshot_path, "rb") as fh:
-                    await app.bot.send_photo(chat_id=chat_id, photo=fh, caption="Появилась капча. Нажми её в Replit Preview, затем жми «Я нажал капчу».", reply_markup=kb)
+                progress(f"Жду капчу: {title}")
+                await _outbox.send_photo(chat_id, photo, caption="Появилась капча. Нажми её в Replit Preview, затем жми «Я нажал капчу».", reply_markup=kb)
 
                 ev = asyncio.Event()
                 _captcha_waiters[chat_id] = ev
                 try:
                     await asyncio.wait_for(ev.wait(), timeout=600)
                 except asyncio.TimeoutError:
-                    await app.bot.send_message(chat_id=chat_id, text="Таймаут ожидания капчи — пропускаю опрос.")
+                    skipped += 1
+                    journal.skipped(s)
+                    await journal.checkpoint()
+                    await _outbox.send_message(chat_id, "Таймаут ожидания капчи — пропускаю опрос.")
                     _captcha_waiters.pop(chat_id, None)
                     continue
                 finally:
                     _captcha_waiters.pop(chat_id, None)
 
                 await pb.continue_after_captcha()
-                users_manager.add_record(chat_id, title, points)
-                await app.bot.send_message(chat_id=chat_id, text=f"Опрос \"{title}\" помечен как пройден ({points} баллов).")
+                line = f"Опрос \"{title}\" помечен как пройден ({points} баллов)."
             else:
                 # TODO: integrate ai_survey_solver to auto-fill
-                users_manager.add_record(chat_id, title, points)
-                await app.bot.send_message(chat_id=chat_id, text=f"Опрос \"{title}\" пройден автоматически ({points} баллов).")
-
-        await app.bot.send_message(chat_id=chat_id, text="Обработка опросов завершена.")
+                line = f"Опрос \"{title}\" пройден автоматически ({points} баллов)."
+            # The key makes a repeat after a resume (crash between record and checkpoint) a no-op
+            if await users_manager.aadd_record(chat_id, title, points, journal.record_key(s)):
+                earned += points
+            journal.completed(s)
+            await journal.checkpoint()
+            survey_cache.discard(chat_id, s)
+            done += 1
+            progress(line)
+
+        await job_journal.adiscard(chat_id)
+        await status.finish(f"Опросы: {done}/{total} пройдено, пропущено {skipped}, баллов {earned}")
+        await _outbox.send_message(chat_id, "Обработка опросов завершена.")
     except asyncio.CancelledError:
-        await app.bot.send_message(chat_id=chat_id, text="Задача была отменена.")
+        job = _scheduler.get(chat_id)
+        if job is None or job.cancel_requested:
+            # Stopped by the user: nothing to resume
+            await job_journal.adiscard(chat_id)
+            await _outbox.send_message(chat_id, "Задача была отменена.")
+        else:
+            # _scheduler.shutdown(): the journal stays and the chat is offered a resume after the restart
+            await _outbox.send_message(chat_id, "Бот перезапускается — прогресс сохранён, после запуска можно будет продолжить.")
     except Exception as e:
         logging.exception("Runner error: %s", e)
-        await app.bot.send_message(chat_id=chat_id, text=f"Ошибка: {e}")
+        await _outbox.send_message(chat_id, f"Ошибка: {e}")
+        if journal is not None and journal.pending():
+            await _offer_resume(chat_id, journal, "Задача прервалась с ошибкой.")
     finally:
         try:
             await pb.stop()
         except:
             pass
 
-def main():
-    if not TELEGRAM_TOKEN:
-        raise RuntimeError("TELEGRAM_BOT_TOKEN env var not set")
+# ----- History and export -----
+PERIOD_NAMES = {"day": "по дням", "week": "по неделям", "month": "по месяцам"}
+
+def _history_keyboard(offset: int, total: int) -> InlineKeyboardMarkup:
+    nav = []
+    if offset > 0:
+        nav.append(InlineKeyboardButton("⬅ Новее", callback_data=f"hist:{max(0, offset - HISTORY_PAGE_SIZE)}"))
+    if offset + HISTORY_PAGE_SIZE < total:
+        nav.append(InlineKeyboardButton("Старше ➡", callback_data=f"hist:{offset + HISTORY_PAGE_SIZE}"))
+    periods = [InlineKeyboardButton(f"📅 {name.capitalize()}", callback_data=f"histagg:{p}") for p, name in PERIOD_NAMES.items()]
+    return InlineKeyboardMarkup([row for row in (nav, periods) if row])
+
+async def _history_page_text(chat_id: int, offset: int):
+    records, total = await users_manager.ahistory_page(chat_id, offset, HISTORY_PAGE_SIZE)
+    if not total:
+        return "История пуста.", None
+    if offset >= total:
+        # A stale button after records were removed: show the last page that still exists
+        offset = (total - 1) // HISTORY_PAGE_SIZE * HISTORY_PAGE_SIZE
+        records, total = await users_manager.ahistory_page(chat_id, offset, HISTORY_PAGE_SIZE)
+        if not total:
+            return "История пуста.", None
+    text = f"📜 История: {offset + 1}–{offset + len(records)} из {total}\n\n"
+    for r in records:
+        text += f"• {r['date']} — {r['points']} баллов — \"{r['title']}\"\n"
+    return text, _history_keyboard(offset, total)
+
+async def history_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    text, kb = await _history_page_text(chat_id, 0)
+    await _outbox.send_message(chat_id, text, reply_markup=kb)
 
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+async def history_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    chat_id = query.message.chat_id
+    kind, _, arg = query.data.partition(":")
+    if kind == "histagg" and arg in PERIOD_NAMES:
+        rows = await users_manager.aaggregate(chat_id, arg, HISTORY_PAGE_SIZE)
+        text = f"📅 Статистика {PERIOD_NAMES[arg]}\n\n" + "".join(
+            f"• {r['period']}: {r['surveys']} опросов, {r['points']} баллов\n" for r in rows
+        ) if rows else "История пуста."
+        kb = InlineKeyboardMarkup([[InlineKeyboardButton("📜 К истории", callback_data="hist:0")]])
+    else:
+        text, kb = await _history_page_text(chat_id, int(arg) if arg.isdigit() else 0)
+    await _outbox.call("edit_message_text", chat_id, message_id=query.message.message_id, text=text, reply_markup=kb)
+
+async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    # Written batch by batch to a temp file and uploaded from the handle, so no copy of the whole CSV sits in memory
+    # (a SpooledTemporaryFile would be rolled over anyway: httpx calls fileno() to get the upload size)
+    with tempfile.TemporaryFile() as f:
+        rows = await users_manager.aexport_csv(chat_id, f)
+        if not rows:
+            await _outbox.send_message(chat_id, "История пуста — выгружать нечего.")
+            return
+        f.seek(0)
+        document = InputFile(f, filename=f"surveys_{chat_id}.csv", read_file_handle=False)
+        await _outbox.send_document(chat_id, document, caption=f"Записей: {rows}")
+
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_chat.id not in ADMIN_CHAT_IDS:
+        return
+    await _outbox.send_message(update.effective_chat.id, metrics.summary_text())
+
+# ----- Startup / shutdown -----
+async def _prewarm():
+    """Phase 2 of startup: import the browser modules and launch the driver and first Chromium."""
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    try:
+        await loop.run_in_executor(None, importlib.import_module, AUTOMATION_MODULE)
+        imported = time.perf_counter()
+        # Holds the pool lock while launching, so an early "find" waits for this browser instead of starting another
+        await sys.modules["browser_pool"].get_pool(headless=True).start()
+    except Exception as e:
+        logging.warning("Browser pre-warm failed, the first job will start the browser itself: %s", e)
+        return
+    ready = time.perf_counter()
+    STARTUP_SECONDS.set(ready - _STARTED, phase="browser")
+    logging.info("Startup phase 2 (browser): imports %.2fs, driver + Chromium %.2fs; browser ready %.2fs after start",
+                 imported - started, ready - imported, ready - _STARTED)
+
+async def _offer_interrupted():
+    for journal in await job_journal.ainterrupted():
+        try:
+            await _offer_resume(journal.chat_id, journal, "Бот перезапускался во время прохождения опросов.")
+        except Exception as e:
+            logging.warning("Could not offer resume to chat %s: %s", journal.chat_id, e)
+
+async def _post_init(app):
+    global _outbox, _metrics_server, _prewarm_task, _resume_offer_task
+    _outbox = Outbox(app.bot)
+    _outbox.start()
+    if metrics.METRICS_PORT:
+        _metrics_server = await metrics.serve()
+    if BROWSER_PREWARM:
+        _prewarm_task = asyncio.create_task(_prewarm())
+    # post_init runs before the application is "running", so app.create_task would not track this
+    _resume_offer_task = asyncio.create_task(_offer_interrupted())
+    elapsed = time.perf_counter() - _STARTED
+    STARTUP_SECONDS.set(elapsed, phase="bot")
+    logging.info("Startup phase 1 (bot): ready to poll %.2fs after start", elapsed)
+
+async def _post_stop(app):
+    # Runs while app.bot is still initialized: the jobs' goodbye messages go out through the outbox,
+    # which is stopped only after them (post_shutdown would come after bot.shutdown())
+    if _resume_offer_task and not _resume_offer_task.done():
+        _resume_offer_task.cancel()
+    await _scheduler.shutdown()
+    if _outbox:
+        await _outbox.stop()
+
+async def _post_shutdown(app):
+    if _prewarm_task and not _prewarm_task.done():
+        _prewarm_task.cancel()
+    if _metrics_server:
+        _metrics_server.close()
+    pool = sys.modules.get("browser_pool")
+    if pool:
+        await pool.shutdown()
+
+def build_application(token: str):
+    # Only different chats run concurrently: ConversationHandler (add account) and the menu state of a chat are
+    # not safe with interleaved updates, so PerChatUpdateProcessor runs each chat's updates one at a time, in order.
+    # Browser work runs in scheduler jobs, so a chat is not held up by a running search.
+    app = (
+        ApplicationBuilder()
+        .token(token)
+        .base_url(TELEGRAM_API_BASE_URL)
+        # Same pool size as PTB's default request; getUpdates keeps its own, untimed request
+        .request(MeasuredRequest(connection_pool_size=256))
+        .concurrent_updates(PerChatUpdateProcessor(BOT_CONCURRENT_UPDATES) if BOT_CONCURRENT_UPDATES > 1 else False)
+        .post_init(_post_init)
+        .post_stop(_post_stop)
+        .post_shutdown(_post_shutdown)
+        .build()
+    )
 
     # Basic handlers
     app.add_handler(CommandHandler("start", start_cmd))
-    app.add_handler(CallbackQueryHandler(handle_callback))
+    app.add_handler(CommandHandler("stats", stats_cmd))
+    app.add_handler(CommandHandler("history", history_cmd))
+    app.add_handler(CommandHandler("export", export_cmd))
 
     # Conversation for add account
     conv = ConversationHandler(
@@ -259,9 +598,37 @@ def main():
     # Quick account menu callbacks
     app.add_handler(CallbackQueryHandler(account_menu_cb, pattern="^account_menu$"))
     app.add_handler(CallbackQueryHandler(delete_account_cb, pattern="^delete_account$"))
+    # Only the first matching handler of a group runs: every callback handler has a pattern and the catch-all is last
+    app.add_handler(CallbackQueryHandler(history_cb, pattern=r"^hist(agg)?:"))
+    app.add_handler(CallbackQueryHandler(handle_callback, pattern=MENU_CALLBACKS))
+    app.add_handler(CallbackQueryHandler(stale_callback))
+    return app
 
-    logging.info("Starting Telegram bot...")
-    app.run_polling()
+def main():
+    if not TELEGRAM_TOKEN:
+        raise RuntimeError("TELEGRAM_BOT_TOKEN env var not set")
+    if BOT_MODE not in ("polling", "webhook"):
+        raise RuntimeError(f"BOT_MODE must be 'polling' or 'webhook', not {BOT_MODE!r}")
+    if BOT_MODE == "webhook" and not WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL env var not set (required with BOT_MODE=webhook)")
+
+    app = build_application(TELEGRAM_TOKEN)
+
+    logging.info("Starting Telegram bot (%s, up to %d concurrent updates)...", BOT_MODE, max(1, BOT_CONCURRENT_UPDATES))
+    try:
+        if BOT_MODE == "webhook":
+            # Registers the webhook with Telegram; run_polling deletes it again when switching back
+            app.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+            )
+        else:
+            app.run_polling()
+    finally:
+        users_manager.flush()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,150 @@
+# browser_pool.py
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+from playwright.async_api import async_playwright, Browser, BrowserContext
+
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "1"))            # Chromium processes
+BROWSER_CONTEXT_IDLE_TTL = float(os.getenv("BROWSER_CONTEXT_IDLE_TTL", "300"))  # seconds
+BROWSER_ARGS = ["--no-sandbox"]
+
+class BrowserPool:
+    """One Playwright driver, a few long-lived Chromium processes and per-chat BrowserContexts.
+
+    Contexts are leased under a key (usually the chat id); a released context stays idle so
+    the same key gets it back with its cookies, until it has been idle for idle_ttl seconds.
+    """
+
+    def __init__(self, size: int = BROWSER_POOL_SIZE, headless: bool = True, idle_ttl: float = BROWSER_CONTEXT_IDLE_TTL):
+        self.size = max(1, size)
+        self.headless = headless
+        self.idle_ttl = idle_ttl
+        self.playwright = None
+        self.browsers: List[Optional[Browser]] = [None] * self.size
+        self._slots: Dict[BrowserContext, int] = {}                        # live context -> browser slot
+        self._idle: Dict[str, Tuple[BrowserContext, float]] = {}          # key -> (context, released at)
+        self._lock = asyncio.Lock()
+        self._sweeper: Optional[asyncio.Task] = None
+
+    async def start(self):
+        async with self._lock:
+            await self._ensure_started()
+
+    async def _ensure_started(self):
+        if self.playwright is None:
+            self.playwright = await async_playwright().start()
+            logging.info("Playwright driver started")
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep())
+        # Launch the first browser eagerly so the first lease only pays for new_context()
+        await self._browser(0)
+
+    async def _browser(self, slot: int) -> Browser:
+        browser = self.browsers[slot]
+        if browser is None or not browser.is_connected():
+            browser = await self.playwright.chromium.launch(headless=self.headless, args=BROWSER_ARGS)
+            browser.on("disconnected", lambda b, slot=slot: self._on_disconnected(slot, b))
+            self.browsers[slot] = browser
+            logging.info("Chromium #%d launched", slot)
+        return browser
+
+    def _on_disconnected(self, slot: int, browser: Browser):
+        if self.browsers[slot] is browser:
+            self.browsers[slot] = None
+        for ctx in [c for c, s in self._slots.items() if s == slot]:
+            self._slots.pop(ctx, None)
+        for key in [k for k, (c, _) in self._idle.items() if c not in self._slots]:
+            self._idle.pop(key, None)
+        logging.warning("Chromium #%d disconnected, it will be relaunched on the next lease", slot)
+
+    def _load(self, slot: int) -> int:
+        return sum(1 for s in self._slots.values() if s == slot)
+
+    def live_browsers(self) -> int:
+        return sum(1 for b in self.browsers if b is not None and b.is_connected())
+
+    async def lease(self, key: Optional[str] = None, **context_kwargs) -> BrowserContext:
+        """Return the idle context stored under key, or a new context on the least loaded browser."""
+        async with self._lock:
+            await self._ensure_started()
+            if key is not None and key in self._idle:
+                ctx, _ = self._idle.pop(key)
+                if ctx in self._slots:
+                    return ctx
+            slot = min(range(self.size), key=self._load)
+            browser = await self._browser(slot)
+            ctx = await browser.new_context(**context_kwargs)
+            self._slots[ctx] = slot
+            return ctx
+
+    async def release(self, ctx: BrowserContext, key: Optional[str] = None):
+        """Give a leased context back; without a key it is closed right away."""
+        if ctx not in self._slots:
+            return
+        if key is None:
+            await self._close(ctx)
+            return
+        previous = self._idle.pop(key, None)
+        self._idle[key] = (ctx, time.monotonic())
+        if previous and previous[0] is not ctx:
+            await self._close(previous[0])
+
+    async def discard(self, key: str):
+        """Close the idle context stored under key, if any."""
+        entry = self._idle.pop(key, None)
+        if entry:
+            await self._close(entry[0])
+
+    async def _close(self, ctx: BrowserContext):
+        self._slots.pop(ctx, None)
+        try:
+            await ctx.close()
+        except Exception as e:
+            logging.warning("Error closing browser context: %s", e)
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(max(1.0, min(self.idle_ttl / 2, 30.0)))
+            now = time.monotonic()
+            for key, (ctx, released) in list(self._idle.items()):
+                if now - released >= self.idle_ttl and self._idle.get(key, (None,))[0] is ctx:
+                    self._idle.pop(key, None)
+                    await self._close(ctx)
+
+    async def close(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+            self._sweeper = None
+        for ctx in list(self._slots):
+            await self._close(ctx)
+        self._idle.clear()
+        for i, browser in enumerate(self.browsers):
+            if browser is not None:
+                try:
+                    await browser.close()
+                except Exception as e:
+                    logging.warning("Error closing browser: %s", e)
+            self.browsers[i] = None
+        if self.playwright:
+            await self.playwright.stop()
+            self.playwright = None
+
+_pool: Optional[BrowserPool] = None
+
+def get_pool(headless: bool = True) -> BrowserPool:
+    """Process-wide pool; headless is only taken into account when the pool is first created."""
+    global _pool
+    if _pool is None:
+        _pool = BrowserPool(headless=headless)
+    return _pool
+
+def live_browsers() -> int:
+    return _pool.live_browsers() if _pool is not None else 0
+
+async def shutdown():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
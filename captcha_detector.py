@@ -0,0 +1,113 @@
+# captcha_detector.py
+import asyncio
+import logging
+from typing import List, Optional
+from playwright.async_api import Frame, Page
+
+def _is_captcha_url(url: str) -> bool:
+    return "recaptcha" in (url or "")
+
+class CaptchaDetector:
+    """Keeps a live "captcha present" flag from frame events of the attached pages.
+
+    Querying the flag costs no Playwright round trips; wait() resolves as soon as a
+    reCAPTCHA frame shows up instead of checking once after a fixed delay.
+    """
+
+    def __init__(self):
+        self._pages: List[Page] = []
+        self._frames: List[Frame] = []       # captcha frames, oldest first
+        self._present = asyncio.Event()
+
+    @property
+    def present(self) -> bool:
+        self._prune()
+        return bool(self._frames)
+
+    @property
+    def frame(self) -> Optional[Frame]:
+        self._prune()
+        return self._frames[-1] if self._frames else None
+
+    @property
+    def frames(self) -> List[Frame]:
+        self._prune()
+        return list(self._frames)
+
+    def attach(self, page: Page):
+        page.on("frameattached", self._on_attached)
+        page.on("framenavigated", self._on_navigated)
+        page.on("framedetached", self._on_detached)
+        page.on("close", self._on_page_closed)
+        self._pages.append(page)
+        for frame in page.frames:
+            self._on_attached(frame)
+
+    def detach(self):
+        for page in self._pages:
+            page.remove_listener("frameattached", self._on_attached)
+            page.remove_listener("framenavigated", self._on_navigated)
+            page.remove_listener("framedetached", self._on_detached)
+            page.remove_listener("close", self._on_page_closed)
+        self._pages.clear()
+        self._frames.clear()
+        self._present.clear()
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait up to timeout ms for a captcha frame; True if one is present."""
+        if self.present:
+            return True
+        try:
+            await asyncio.wait_for(self._present.wait(), timeout / 1000)
+        except asyncio.TimeoutError:
+            pass
+        return self.present
+
+    def _prune(self):
+        # Closing a page emits only "close", never framedetached for its frames
+        alive = [f for f in self._frames if not f.is_detached() and not f.page.is_closed()]
+        if len(alive) != len(self._frames):
+            self._frames[:] = alive
+            if not alive:
+                self._present.clear()
+
+    def _on_page_closed(self, page: Page):
+        self._frames[:] = [f for f in self._frames if f.page is not page]
+        if not self._frames:
+            self._present.clear()
+
+    def _mark(self, frame: Frame, is_captcha: bool):
+        if is_captcha and frame not in self._frames:
+            self._frames.append(frame)
+            self._present.set()
+            logging.info("Detected reCAPTCHA iframe: %s", frame.url)
+        elif not is_captcha and frame in self._frames:
+            self._frames.remove(frame)
+        if not self._frames:
+            self._present.clear()
+
+    def _on_attached(self, frame: Frame):
+        if frame.parent_frame is None:
+            return
+        if _is_captcha_url(frame.url):
+            self._mark(frame, True)
+        else:
+            # The src may not be loaded yet; the iframe title can still identify the widget
+            asyncio.ensure_future(self._probe_title(frame))
+
+    def _on_navigated(self, frame: Frame):
+        if frame.parent_frame is not None:
+            self._mark(frame, _is_captcha_url(frame.url))
+
+    def _on_detached(self, frame: Frame):
+        self._mark(frame, False)
+
+    async def _probe_title(self, frame: Frame):
+        try:
+            element = await frame.frame_element()
+            title = await element.get_attribute("title") or ""
+            src = await element.get_attribute("src") or ""
+        except Exception:
+            return  # frame went away before we could look at it
+        if not frame.is_detached() and ("recaptcha" in title.lower() or _is_captcha_url(src)):
+            self._mark(frame, True)
@@ -0,0 +1,165 @@
+# job_journal.py
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+# Checkpoints of running survey jobs, one file per chat, so a restarted bot can resume them
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", "journal")
+
+RUNNING = "running"
+CAPTCHA = "captcha"   # waiting for the user to solve a captcha on journal["current"]
+
+def survey_key(survey: Dict[str, Any]) -> str:
+    """Stable id of a survey card across rescans and restarts (the index and XPath are not)."""
+    raw = f"{survey.get('title', '')}\0{survey.get('points', 0)}\0{survey.get('duration', '')}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+def journal_path(chat_id: int) -> str:
+    return os.path.join(JOURNAL_DIR, f"{chat_id}.json")
+
+def _write(path: str, text: str):
+    os.makedirs(JOURNAL_DIR, exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+class Journal:
+    """Progress of one start_all run: the survey list snapshot and what happened to each survey."""
+
+    def __init__(self, chat_id: int, data: Optional[Dict[str, Any]] = None):
+        self.chat_id = chat_id
+        self.data = data or {
+            "chat_id": chat_id,
+            "run_id": uuid.uuid4().hex[:12],
+            "state": RUNNING,
+            "started": time.time(),
+            "updated": time.time(),
+            "surveys": [],
+            "index": 0,
+            "current": None,
+            "completed": [],
+            "skipped": [],
+        }
+
+    @property
+    def run_id(self) -> str:
+        return self.data.get("run_id") or f"{self.data['started']:.0f}"
+
+    def record_key(self, survey: Dict[str, Any]) -> str:
+        """Idempotency key for users_manager.add_record: one record per survey per run.
+
+        A later run may meet a survey with the same title, points and duration again and
+        must be able to record it, so the survey key alone would be too broad.
+        """
+        return f"{self.run_id}:{survey_key(survey)}"
+
+    @property
+    def surveys(self) -> List[Dict[str, Any]]:
+        return self.data["surveys"]
+
+    @property
+    def done_keys(self) -> set:
+        return set(self.data["completed"]) | set(self.data["skipped"])
+
+    def pending(self) -> List[Dict[str, Any]]:
+        """Snapshot surveys not completed or skipped yet, in list order."""
+        done = self.done_keys
+        return [s for s in self.surveys if survey_key(s) not in done]
+
+    def set_surveys(self, surveys: List[Dict[str, Any]]):
+        """Replace the snapshot (after a rescan), keeping the surveys already handled."""
+        done = self.done_keys
+        kept = [s for s in self.surveys if survey_key(s) in done]
+        kept_keys = {survey_key(s) for s in kept}
+        self.data["surveys"] = kept + [s for s in surveys if survey_key(s) not in kept_keys]
+
+    def begin(self, survey: Dict[str, Any]):
+        self.data["index"] = len(self.done_keys)
+        self.data["current"] = survey_key(survey)
+        self.data["state"] = RUNNING
+
+    def waiting_captcha(self):
+        self.data["state"] = CAPTCHA
+
+    def completed(self, survey: Dict[str, Any]):
+        self._close(survey, "completed")
+
+    def skipped(self, survey: Dict[str, Any]):
+        self._close(survey, "skipped")
+
+    def _close(self, survey: Dict[str, Any], bucket: str):
+        key = survey_key(survey)
+        if key not in self.data[bucket]:
+            self.data[bucket].append(key)
+        self.data["current"] = None
+        self.data["state"] = RUNNING
+        self.data["index"] = len(self.done_keys)
+
+    def progress(self) -> Dict[str, int]:
+        return {
+            "completed": len(self.data["completed"]),
+            "skipped": len(self.data["skipped"]),
+            "total": len(self.surveys),
+        }
+
+    async def checkpoint(self):
+        """Persist the current state; the file write and fsync run off the event loop."""
+        self.data["updated"] = time.time()
+        text = json.dumps(self.data, ensure_ascii=False)
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, _write, journal_path(self.chat_id), text)
+        except OSError as e:
+            logging.warning("Could not write job journal for chat %s: %s", self.chat_id, e)
+
+def load(chat_id: int) -> Optional[Journal]:
+    try:
+        with open(journal_path(chat_id), "r", encoding="utf-8") as f:
+            return Journal(chat_id, json.load(f))
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        logging.warning("Unreadable job journal for chat %s, dropping it: %s", chat_id, e)
+        discard(chat_id)
+        return None
+
+def discard(chat_id: int):
+    try:
+        os.remove(journal_path(chat_id))
+    except FileNotFoundError:
+        pass
+
+def interrupted() -> List[Journal]:
+    """Journals left behind by runs that never finished (the bot restarted or the runner failed)."""
+    if not os.path.isdir(JOURNAL_DIR):
+        return []
+    found = []
+    for name in sorted(os.listdir(JOURNAL_DIR)):
+        stem, ext = os.path.splitext(name)
+        if ext != ".json" or not stem.lstrip("-").isdigit():
+            continue
+        journal = load(int(stem))
+        if journal is not None:
+            found.append(journal)
+    return found
+
+# ----- Async variants for the bot: the file work runs on the default executor, like checkpoint() -----
+async def _run(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+async def aload(chat_id: int) -> Optional[Journal]:
+    return await _run(load, chat_id)
+
+async def adiscard(chat_id: int):
+    await _run(discard, chat_id)
+
+async def ainterrupted() -> List[Journal]:
+    return await _run(interrupted)
@@ -0,0 +1,258 @@
+# metrics.py
+import asyncio
+import contextlib
+import functools
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Port of the Prometheus text endpoint (GET /metrics); 0 disables it
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Sample RSS (and tracemalloc, when enabled) around every browser job
+METRICS_JOB_MEMORY = os.getenv("METRICS_JOB_MEMORY", "1").lower() in ("1", "true", "yes")
+METRICS_TRACEMALLOC = os.getenv("METRICS_TRACEMALLOC", "0").lower() in ("1", "true", "yes")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _fmt_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    esc = lambda v: v.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()   # users_manager updates metrics from its executor threads
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_fmt_labels(labels)} {value:g}")
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, k, v) for k, v in self._values.items()]
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, help)
+        self._values: Dict[Labels, float] = {}
+        self._fn = fn
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_labels(labels)] = value
+
+    def set_function(self, fn: Callable[[], float]):
+        """Read the value from fn() at scrape time instead of storing it."""
+        self._fn = fn
+
+    def samples(self):
+        if self._fn is not None:
+            try:
+                return [(self.name, (), float(self._fn()))]
+            except Exception as e:
+                logging.warning("Gauge %s callback failed: %s", self.name, e)
+                return []
+        with self._lock:
+            return [(self.name, k, v) for k, v in self._values.items()]
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Labels, List[float]] = {}   # labels -> bucket counts + [sum, count]
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, series in self._series.items():
+                for bound, n in zip(self.buckets, series):
+                    out.append((f"{self.name}_bucket", key + (("le", f"{bound:g}"),), n))
+                out.append((f"{self.name}_bucket", key + (("le", "+Inf"),), series[-1]))
+                out.append((f"{self.name}_sum", key, series[-2]))
+                out.append((f"{self.name}_count", key, series[-1]))
+        return out
+
+    def totals(self) -> Dict[Labels, Tuple[int, float]]:
+        with self._lock:
+            return {key: (int(s[-1]), s[-2]) for key, s in self._series.items()}
+
+_registry: Dict[str, _Metric] = {}
+
+def _register(metric: _Metric) -> _Metric:
+    return _registry.setdefault(metric.name, metric)
+
+def counter(name: str, help: str) -> Counter:
+    return _register(Counter(name, help))
+
+def gauge(name: str, help: str, fn: Optional[Callable[[], float]] = None) -> Gauge:
+    g = _register(Gauge(name, help))
+    if fn is not None:
+        g.set_function(fn)
+    return g
+
+def histogram(name: str, help: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram(name, help, buckets))
+
+def render() -> str:
+    return "\n".join(m.render() for m in _registry.values()) + "\n"
+
+# ----- Timing helpers -----
+@contextlib.contextmanager
+def timer(hist: Histogram, errors: Optional[Counter] = None, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        if errors is not None and not isinstance(e, (asyncio.CancelledError, GeneratorExit)):
+            errors.inc(**labels)
+        raise
+    finally:
+        hist.observe(time.perf_counter() - started, **labels)
+
+def timed(hist: Histogram, errors: Optional[Counter] = None, **labels):
+    """Decorator observing the duration of a sync or async function in hist."""
+    def wrap(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with timer(hist, errors, **labels):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(hist, errors, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return wrap
+
+# ----- Process memory -----
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+JOB_RSS_DELTA = histogram(
+    "bot_job_rss_delta_bytes", "Change of the bot process RSS over one browser job",
+    buckets=(-50e6, -10e6, 0, 1e6, 5e6, 10e6, 25e6, 50e6, 100e6, 250e6),
+)
+JOB_PY_PEAK = histogram(
+    "bot_job_python_peak_bytes", "Peak Python allocations (tracemalloc) during one browser job",
+    buckets=(1e6, 5e6, 10e6, 25e6, 50e6, 100e6, 250e6),
+)
+
+@contextlib.contextmanager
+def job_memory(kind: str):
+    """Record RSS growth (and the tracemalloc peak if METRICS_TRACEMALLOC) of one job.
+
+    Jobs run concurrently in one process, so both numbers include whatever else ran meanwhile.
+    """
+    if not METRICS_JOB_MEMORY:
+        yield
+        return
+    if METRICS_TRACEMALLOC and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    before = rss_bytes()
+    try:
+        yield
+    finally:
+        JOB_RSS_DELTA.observe(rss_bytes() - before, kind=kind)
+        if tracemalloc.is_tracing():
+            JOB_PY_PEAK.observe(tracemalloc.get_traced_memory()[1], kind=kind)
+
+PROCESS_RSS = gauge("bot_process_rss_bytes", "Resident memory of the bot process", rss_bytes)
+
+def summary_text() -> str:
+    """Short human-readable digest for the /stats command."""
+    lines = []
+    for m in _registry.values():
+        if isinstance(m, Gauge):
+            for _, labels, value in m.samples():
+                lines.append(f"{m.name}{_fmt_labels(labels)} = {value:g}")
+        elif isinstance(m, Histogram):
+            for labels, (count, total) in sorted(m.totals().items()):
+                if count:
+                    lines.append(f"{m.name}{_fmt_labels(labels)}: n={count}, avg={total / count:.3f}")
+        elif isinstance(m, Counter):
+            for _, labels, value in m.samples():
+                lines.append(f"{m.name}{_fmt_labels(labels)} = {value:g}")
+    return "\n".join(lines) or "Нет данных."
+
+# ----- HTTP endpoint -----
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 10)
+        while (await asyncio.wait_for(reader.readline(), 10)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            body, status = render().encode("utf-8"), "200 OK"
+        else:
+            body, status = b"not found\n", "404 Not Found"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logging.debug("Metrics request failed: %s", e)
+    finally:
+        writer.close()
+
+async def serve(host: str = METRICS_HOST, port: int = METRICS_PORT) -> asyncio.AbstractServer:
+    server = await asyncio.start_server(_handle, host, port)
+    logging.info("Metrics endpoint on http://%s:%d/metrics", host, port)
+    return server
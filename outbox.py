@@ -0,0 +1,242 @@
+# outbox.py
+import asyncio
+import itertools
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from telegram import InputFile
+from telegram.error import RetryAfter
+from telegram.request import HTTPXRequest
+import metrics
+
+PRIORITY_INTERACTIVE = 0   # direct replies to a button press or command
+PRIORITY_PROGRESS = 1      # runner status updates
+
+# Telegram allows about one message per second per chat and ~30 per second overall
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1.0"))
+OUTBOX_CHAT_BURST = float(os.getenv("OUTBOX_CHAT_BURST", "3"))
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "25"))
+STATUS_MIN_INTERVAL = float(os.getenv("STATUS_MIN_INTERVAL", "3.0"))  # seconds between edits of one status message
+
+API_SECONDS = metrics.histogram("bot_telegram_api_seconds", "Duration of Bot API calls by API method (getUpdates excluded)")
+API_ERRORS = metrics.counter("bot_telegram_api_errors_total", "Bot API calls that failed (RetryAfter included)")
+API_RETRIES = metrics.counter("bot_telegram_retry_after_total", "Bot API calls requeued because of flood control")
+
+class MeasuredRequest(HTTPXRequest):
+    """HTTPXRequest timing every Bot API call, whether it goes through the Outbox or not (query.answer, reply_text)."""
+
+    async def do_request(self, url: str, method: str, request_data=None, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        with metrics.timer(API_SECONDS, API_ERRORS, method=api_method):
+            code, payload = await super().do_request(url, method, request_data, **kwargs)
+        if not 200 <= code <= 299:
+            # Telegram's error answers (RetryAfter, BadRequest, ...) come back as a status code, not an exception
+            API_ERRORS.inc(method=api_method)
+        return code, payload
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available (0 when one can be taken now)."""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        """Hold the bucket closed, e.g. for the retry_after Telegram asked for."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = min(self.tokens, 0)
+
+def _seconds(retry_after) -> float:
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+class Outbox:
+    """Queue for outgoing Bot API calls with per-chat and global token buckets.
+
+    Interactive replies overtake queued progress updates; RetryAfter is honoured by
+    closing the chat's (and the global) bucket and retrying instead of failing the caller.
+    """
+
+    def __init__(self, bot, chat_rate: float = OUTBOX_CHAT_RATE, chat_burst: float = OUTBOX_CHAT_BURST,
+                 global_rate: float = OUTBOX_GLOBAL_RATE):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._queue: List[Tuple[int, int, int, str, Dict[str, Any], asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._queue)
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        for *_, fut in self._queue:
+            if not fut.done():
+                fut.cancel()
+        self._queue.clear()
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _push(self, item):
+        self._queue.append(item)
+        self._wakeup.set()
+
+    async def call(self, method: str, chat_id: int, priority: int = PRIORITY_INTERACTIVE, **kwargs):
+        """Run bot.<method>(chat_id=chat_id, **kwargs) once the rate limits allow it and return its result."""
+        fut = asyncio.get_running_loop().create_future()
+        kwargs["chat_id"] = chat_id
+        self._push((priority, next(self._seq), chat_id, method, kwargs, fut))
+        return await fut
+
+    async def send_message(self, chat_id: int, text: str, priority: int = PRIORITY_INTERACTIVE, **kwargs):
+        return await self.call("send_message", chat_id, priority, text=text, **kwargs)
+
+    async def send_photo(self, chat_id: int, photo, priority: int = PRIORITY_INTERACTIVE, **kwargs):
+        return await self.call("send_photo", chat_id, priority, photo=photo, **kwargs)
+
+    async def send_document(self, chat_id: int, document, priority: int = PRIORITY_INTERACTIVE, **kwargs):
+        return await self.call("send_document", chat_id, priority, document=document, **kwargs)
+
+    def status(self, chat_id: int) -> "StatusMessage":
+        """A new status message for chat_id; nothing is sent until its first update()."""
+        return StatusMessage(self, chat_id)
+
+    async def _run(self):
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            wait = self._global.delay()
+            chosen = None
+            if wait == 0:
+                wait = None
+                for item in sorted(self._queue, key=lambda it: it[:2]):
+                    if item[5].done():           # caller gave up
+                        self._queue.remove(item)
+                        continue
+                    d = self._bucket(item[2]).delay()
+                    if d == 0:
+                        chosen = item
+                        break
+                    wait = d if wait is None else min(wait, d)
+            if chosen is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._queue.remove(chosen)
+            self._global.take()
+            self._bucket(chosen[2]).take()
+            asyncio.create_task(self._execute(chosen))
+
+    async def _execute(self, item):
+        priority, seq, chat_id, method, kwargs, fut = item
+        if fut.done():
+            return
+        for value in kwargs.values():
+            # Streamed uploads (read_file_handle=False) are read by the request; a retry starts over
+            if isinstance(value, InputFile) and hasattr(value.input_file_content, "seek"):
+                value.input_file_content.seek(0)
+        try:
+            # Timed by MeasuredRequest
+            result = await getattr(self.bot, method)(**kwargs)
+        except RetryAfter as e:
+            API_RETRIES.inc(method=method)
+            seconds = _seconds(e.retry_after)
+            logging.warning("Flood control on chat %s: retrying %s in %.1f s", chat_id, method, seconds)
+            self._bucket(chat_id).block(seconds)
+            self._global.block(min(seconds, 1.0))
+            self._push(item)
+            return
+        except Exception as e:
+            if not fut.done():
+                fut.set_exception(e)
+            return
+        if not fut.done():
+            fut.set_result(result)
+
+class StatusMessage:
+    """One progress message edited in place; updates in between edits are coalesced to the latest text."""
+
+    def __init__(self, outbox: Outbox, chat_id: int, min_interval: float = STATUS_MIN_INTERVAL):
+        self.outbox = outbox
+        self.chat_id = chat_id
+        self.min_interval = min_interval
+        self.message_id: Optional[int] = None
+        self._text: Optional[str] = None
+        self._sent: Optional[str] = None
+        self._last = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def update(self, text: str):
+        """Schedule text to be shown; returns immediately."""
+        self._text = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+
+    async def finish(self, text: Optional[str] = None):
+        """Show the final text (if given) and wait until it has been delivered."""
+        if text is not None:
+            self._text = text
+        if self._task and not self._task.done():
+            await self._task
+        await self._flush(coalesce=False)
+
+    async def _flush(self, coalesce: bool = True):
+        while self._text is not None and self._text != self._sent:
+            if coalesce:
+                wait = self._last + self.min_interval - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            text = self._text
+            try:
+                if self.message_id is None:
+                    msg = await self.outbox.send_message(self.chat_id, text, priority=PRIORITY_PROGRESS)
+                    self.message_id = msg.message_id
+                else:
+                    await self.outbox.call("edit_message_text", self.chat_id, PRIORITY_PROGRESS,
+                                           message_id=self.message_id, text=text)
+            except Exception as e:
+                logging.warning("Status update for chat %s failed: %s", self.chat_id, e)
+                return
+            self._sent = text
+            self._last = time.monotonic()
@@ -0,0 +1,148 @@
+# request_policy.py
+import logging
+import os
+from typing import Dict, Optional, Set, Tuple
+from playwright.async_api import BrowserContext, Page, Request, Response, Route
+import metrics
+
+def _env_list(name: str, default: str) -> Tuple[str, ...]:
+    return tuple(x.strip().lower() for x in os.getenv(name, default).split(",") if x.strip())
+
+# Set to 0 to let every request through (the counters still work)
+ROUTE_POLICY = os.getenv("ROUTE_POLICY", "1").lower() in ("1", "true", "yes")
+# Playwright resource types aborted on list/login pages
+ROUTE_BLOCK_TYPES = _env_list("ROUTE_BLOCK_TYPES", "image,media,font")
+# URL substrings aborted whatever their type: analytics, ads, tracking pixels
+ROUTE_BLOCK_URLS = _env_list(
+    "ROUTE_BLOCK_URLS",
+    "google-analytics.com,googletagmanager.com,doubleclick.net,mc.yandex.ru,top-fwz1.mail.ru,"
+    "connect.facebook.net,vk.com/rtrg,hotjar.com",
+)
+# URL substrings never blocked; matching the request or the frame it comes from is enough
+ROUTE_ALLOW_URLS = _env_list("ROUTE_ALLOW_URLS", "recaptcha,gstatic.com")
+
+REQUESTS = metrics.counter("bot_browser_requests_total", "Browser requests by routing decision and reason")
+ALLOWED_BYTES = metrics.counter("bot_browser_allowed_bytes_total", "Content-Length of responses to allowed requests")
+
+class RouteStats:
+    """Counters of one run; blocked requests are never sent, so only allowed ones have a size."""
+
+    def __init__(self):
+        self.allowed = 0
+        self.blocked = 0
+        self.allowed_bytes = 0
+        self.by_reason: Dict[str, int] = {}
+
+    def count(self, action: str, reason: str):
+        setattr(self, action, getattr(self, action) + 1)
+        key = f"{action}:{reason}"
+        self.by_reason[key] = self.by_reason.get(key, 0) + 1
+        REQUESTS.inc(action=action, reason=reason)
+
+    def summary(self) -> Dict:
+        return {
+            "allowed": self.allowed,
+            "blocked": self.blocked,
+            "allowed_kb": round(self.allowed_bytes / 1024, 1),
+            "by_reason": dict(sorted(self.by_reason.items())),
+        }
+
+class RequestPolicy:
+    """Aborts heavy or third-party requests of a BrowserContext through context.route().
+
+    Pages passed to allow_page() (the survey itself, popups) and frames matching the
+    allowlist (captcha widgets) load fully. Note that routing disables Chromium's HTTP
+    cache for the context; set ROUTE_POLICY=0 to compare runs without it.
+    """
+
+    def __init__(self, block_types=ROUTE_BLOCK_TYPES, block_urls=ROUTE_BLOCK_URLS, allow_urls=ROUTE_ALLOW_URLS,
+                 enabled: bool = ROUTE_POLICY):
+        self.block_types = frozenset(block_types)
+        self.block_urls = tuple(block_urls)
+        self.allow_urls = tuple(allow_urls)
+        self.enabled = enabled
+        self.stats = RouteStats()
+        self._context: Optional[BrowserContext] = None
+        self._full_pages: Set[Page] = set()
+
+    def decide(self, resource_type: str, url: str, frame_url: str = "", top_navigation: bool = False,
+               full_page: bool = False) -> Tuple[bool, str]:
+        """(allowed, reason) for one request."""
+        url = url.lower()
+        if any(p in url for p in self.allow_urls) or any(p in frame_url.lower() for p in self.allow_urls):
+            return True, "allowlist"
+        if top_navigation:
+            return True, "navigation"
+        if any(p in url for p in self.block_urls):
+            return False, "url"
+        if full_page:
+            return True, "full_page"
+        if resource_type in self.block_types:
+            return False, resource_type
+        return True, "default"
+
+    async def attach(self, context: BrowserContext):
+        self._context = context
+        context.on("page", self._on_page)
+        context.on("response", self._on_response)
+        if self.enabled:
+            await context.route("**/*", self._route)
+        else:
+            context.on("request", self._on_request)
+
+    async def detach(self):
+        """Remove the route and listeners; pooled contexts outlive the run that attached them."""
+        context, self._context = self._context, None
+        self._full_pages.clear()
+        if context is None:
+            return
+        context.remove_listener("page", self._on_page)
+        context.remove_listener("response", self._on_response)
+        if not self.enabled:
+            context.remove_listener("request", self._on_request)
+            return
+        try:
+            await context.unroute("**/*", self._route)
+        except Exception as e:
+            logging.warning("Could not remove request route: %s", e)
+
+    def allow_page(self, page: Page):
+        self._full_pages.add(page)
+
+    def restrict_page(self, page: Page):
+        self._full_pages.discard(page)
+
+    def _on_page(self, page: Page):
+        # Every page after the first one is a survey popup
+        if self._context is not None and len(self._context.pages) > 1:
+            self.allow_page(page)
+
+    def _on_request(self, request: Request):
+        self.stats.count("allowed", "disabled")
+
+    def _on_response(self, response: Response):
+        try:
+            size = int(response.headers.get("content-length") or 0)
+        except ValueError:
+            size = 0
+        self.stats.allowed_bytes += size
+        ALLOWED_BYTES.inc(size)
+
+    async def _route(self, route: Route, request: Request):
+        try:
+            frame = request.frame
+            frame_url, top_navigation = frame.url, request.is_navigation_request() and frame.parent_frame is None
+            full_page = frame.page in self._full_pages
+        except Exception:
+            # Service worker requests have no frame
+            frame_url, top_navigation, full_page = "", False, False
+        allowed, reason = self.decide(request.resource_type, request.url, frame_url, top_navigation, full_page)
+        self.stats.count("allowed" if allowed else "blocked", reason)
+        try:
+            if allowed:
+                await route.continue_()
+            else:
+                await route.abort("blockedbyclient")
+        except Exception as e:
+            # The page went away while the request was pending
+            logging.debug("Route %s failed: %s", request.url, e)
@@ -0,0 +1,165 @@
+# scheduler.py
+import asyncio
+import collections
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+# Jobs that hold a browser context at the same time; the rest wait in FIFO order
+MAX_BROWSER_JOBS = int(os.getenv("MAX_BROWSER_JOBS", "3"))
+# Waiting jobs beyond this are turned away instead of queued
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "50"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+class QueueFull(Exception):
+    pass
+
+class Job:
+    def __init__(self, chat_id: int, kind: str, on_position: Optional[Callable[[int], Awaitable]] = None):
+        self.chat_id = chat_id
+        self.kind = kind
+        self.state = QUEUED
+        self.on_position = on_position
+        self.task: Optional[asyncio.Task] = None
+        self.created = time.monotonic()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.cancel_requested = False
+        self._admitted: Optional[asyncio.Future] = None
+
+    @property
+    def active(self) -> bool:
+        return self.state in (QUEUED, RUNNING)
+
+class JobScheduler:
+    """One active job per chat, at most max_running of them running, the rest queued FIFO."""
+
+    def __init__(self, max_running: int = MAX_BROWSER_JOBS, max_queued: int = MAX_QUEUED_JOBS):
+        self.max_running = max(1, max_running)
+        self.max_queued = max_queued
+        self._jobs: Dict[int, Job] = {}         # chat_id -> its active job
+        self._waiting: Deque[Job] = collections.deque()
+        self._running = 0
+
+    def get(self, chat_id: int) -> Optional[Job]:
+        job = self._jobs.get(chat_id)
+        return job if job and job.active else None
+
+    def busy(self, chat_id: int) -> bool:
+        return self.get(chat_id) is not None
+
+    def position(self, chat_id: int) -> Optional[int]:
+        """1-based place in the wait queue, None when the chat has no queued job."""
+        for i, job in enumerate(self._waiting, start=1):
+            if job.chat_id == chat_id:
+                return i
+        return None
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiting)
+
+    def submit(self, chat_id: int, kind: str, factory: Callable[[], Awaitable],
+               on_position: Optional[Callable[[int], Awaitable]] = None) -> Job:
+        """Start factory() now if a slot is free, otherwise queue it.
+
+        on_position(n) is awaited (in the background) whenever the job's queue position changes.
+        Raises QueueFull when the wait queue is at max_queued.
+        """
+        if self.busy(chat_id):
+            raise RuntimeError(f"chat {chat_id} already has an active job")
+        job = Job(chat_id, kind, on_position)
+        job._admitted = asyncio.get_running_loop().create_future()
+        if self._running < self.max_running and not self._waiting:
+            self._admit(job)
+        elif len(self._waiting) >= self.max_queued:
+            raise QueueFull()
+        else:
+            self._waiting.append(job)
+            self._notify(job, len(self._waiting))
+        self._jobs[chat_id] = job
+        job.task = asyncio.create_task(self._run(job, factory))
+        job.task.add_done_callback(lambda t: self._finished(job, t))
+        return job
+
+    def cancel(self, chat_id: int) -> Optional[str]:
+        """Cancel the chat's job; returns the state it was in, or None if there was nothing to cancel."""
+        job = self.get(chat_id)
+        if job is None:
+            return None
+        state = job.state
+        job.cancel_requested = True
+        job.task.cancel()
+        return state
+
+    async def shutdown(self, timeout: float = 10.0):
+        """Cancel all running and queued jobs for a bot shutdown and wait for them to wind down.
+
+        Unlike cancel(), jobs are not marked as cancelled by the user, so runners keep their
+        journals for a resume after the restart.
+        """
+        tasks = [job.task for job in self._jobs.values() if job.active and job.task]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            if pending:
+                logging.warning("%d jobs still running %.0f s after shutdown was requested", len(pending), timeout)
+
+    def _admit(self, job: Job):
+        self._running += 1
+        job.state = RUNNING
+        job.started = time.monotonic()
+        job._admitted.set_result(None)
+
+    def _admit_waiting(self, changed: bool = False):
+        while self._waiting and self._running < self.max_running:
+            self._admit(self._waiting.popleft())
+            changed = True
+        if changed:
+            for i, job in enumerate(self._waiting, start=1):
+                self._notify(job, i)
+
+    def _notify(self, job: Job, position: int):
+        if job.on_position:
+            task = asyncio.ensure_future(job.on_position(position))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception() is None
+                                   or logging.warning("Queue notification failed: %s", t.exception()))
+
+    async def _run(self, job: Job, factory: Callable[[], Awaitable]):
+        await job._admitted
+        try:
+            await factory()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job.state = FAILED
+            logging.exception("Job %s for chat %s failed: %s", job.kind, job.chat_id, e)
+        else:
+            # Runners catch CancelledError themselves to say goodbye to the user
+            job.state = CANCELLED if job.cancel_requested else DONE
+
+    def _finished(self, job: Job, task: asyncio.Task):
+        # Done callback rather than finally: a task cancelled before it ever ran skips its body
+        if task.cancelled():
+            job.state = CANCELLED
+        job.finished = time.monotonic()
+        removed = False
+        if job.started is not None:
+            self._running -= 1
+        elif job in self._waiting:
+            self._waiting.remove(job)
+            removed = True
+        if self._jobs.get(job.chat_id) is job:
+            self._jobs.pop(job.chat_id)
+        self._admit_waiting(changed=removed)
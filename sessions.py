@@ -0,0 +1,32 @@
+# sessions.py
+import json
+import logging
+import os
+from typing import Optional, Dict, Any
+
+# Playwright storage_state snapshots (cookies + localStorage) of logged-in contexts, one file per chat
+SESSIONS_DIR = os.getenv("SESSIONS_DIR", "sessions")
+
+def session_path(key: str) -> str:
+    return os.path.join(SESSIONS_DIR, f"{key}.json")
+
+def load_path(key: str) -> Optional[str]:
+    """Path of the saved state for key, or None when there is nothing to restore."""
+    path = session_path(key)
+    return path if os.path.exists(path) else None
+
+def save(key: str, state: Dict[str, Any]):
+    os.makedirs(SESSIONS_DIR, exist_ok=True)
+    path = session_path(key)
+    tmp = f"{path}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+def invalidate(key):
+    try:
+        os.remove(session_path(str(key)))
+        logging.info("Session %s invalidated", key)
+    except FileNotFoundError:
+        pass
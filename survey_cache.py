@@ -0,0 +1,37 @@
+# survey_cache.py
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+# How long a scanned survey list is trusted before "find"/"start_all" scan again
+SURVEY_CACHE_TTL = float(os.getenv("SURVEY_CACHE_TTL", "120"))
+
+_entries: Dict[int, Tuple[float, List[Dict]]] = {}   # chat_id -> (fetched at, surveys)
+
+def get(chat_id: int, ttl: float = None) -> Optional[List[Dict]]:
+    """Cached surveys for chat_id, or None when missing or older than ttl seconds."""
+    entry = _entries.get(chat_id)
+    if entry is None:
+        return None
+    fetched, surveys = entry
+    if time.monotonic() - fetched > (SURVEY_CACHE_TTL if ttl is None else ttl):
+        _entries.pop(chat_id, None)
+        return None
+    return list(surveys)
+
+def age(chat_id: int) -> Optional[float]:
+    entry = _entries.get(chat_id)
+    return time.monotonic() - entry[0] if entry else None
+
+def put(chat_id: int, surveys: List[Dict]):
+    _entries[chat_id] = (time.monotonic(), list(surveys))
+
+def discard(chat_id: int, survey: Dict):
+    """Drop a completed survey from the cached list, keeping the entry's timestamp."""
+    entry = _entries.get(chat_id)
+    if entry:
+        fetched, surveys = entry
+        _entries[chat_id] = (fetched, [s for s in surveys if s.get("title") != survey.get("title")])
+
+def invalidate(chat_id: int):
+    _entries.pop(chat_id, None)
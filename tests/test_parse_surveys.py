@@ -0,0 +1,55 @@
+# tests/test_parse_surveys.py
+import os
+import re
+
+from bs4 import BeautifulSoup
+
+from web_automation_playwright import SURVEY_BUTTON_XPATH, parse_surveys
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "surveys_page.html")
+
+def _load():
+    with open(FIXTURE, encoding="utf-8") as f:
+        return f.read()
+
+def _xpath_string_value(tag) -> str:
+    # normalize-space() of an element: its descendant text nodes concatenated, XPath whitespace collapsed
+    text = "".join(tag.strings)
+    return " ".join(re.split(r"[ \t\r\n]+", text.strip(" \t\r\n")))
+
+def test_fields():
+    surveys = parse_surveys(_load())
+    assert [(s["index"], s["title"], s["points"], s["duration"]) for s in surveys] == [
+        (0, "Опрос№5", 50, "10"),
+        (1, "Отношение к бытовой технике", 30, "7"),
+        (2, "Мнение о погоде", 10, "3"),
+        (3, "Мнение о погоде", 15, "5"),
+        (4, "Короткий опрос без заголовка · 5 баллов Пройти опрос", 5, "N/A"),
+        (5, "Опрос \"О 'кавычках'\"", 20, "4"),
+    ]
+
+def test_unique_titles_are_anchored_on_the_h5_string_value():
+    html = _load()
+    h5_values = [_xpath_string_value(h5) for h5 in BeautifulSoup(html, "html.parser").find_all("h5")]
+    by_title = {s["title"]: s for s in parse_surveys(html)}
+    for title in ("Опрос№5", "Отношение к бытовой технике"):
+        assert title in h5_values
+        assert by_title[title]["button_xpath"] == (
+            f"{SURVEY_BUTTON_XPATH}[ancestor::div[contains(@class, 'card')][1][.//h5[normalize-space()='{title}']]]"
+        )
+
+def test_button_text_after_a_leading_text_node_is_ignored():
+    # contains(text(), ...) only looks at the first text node, here the blank before the icon
+    assert len(parse_surveys(_load())) == 6
+
+def test_quotes_use_concat():
+    survey = parse_surveys(_load())[5]
+    assert "concat('Опрос \"О ', \"'\", 'кавычках', \"'\", '\"')" in survey["button_xpath"]
+
+def test_duplicate_or_missing_titles_fall_back_to_position():
+    surveys = parse_surveys(_load())
+    for i in (2, 3, 4):
+        assert surveys[i]["button_xpath"] == f"({SURVEY_BUTTON_XPATH})[{i + 1}]"
+
+def test_empty_page():
+    assert parse_surveys("<html><body><p>Нет опросов</p></body></html>") == []
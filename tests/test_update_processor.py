@@ -0,0 +1,71 @@
+# tests/test_update_processor.py
+import asyncio
+from types import SimpleNamespace
+
+from update_processor import PerChatUpdateProcessor
+
+def _update(chat_id):
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id) if chat_id is not None else None)
+
+async def _handler(log, name, delay):
+    log.append(("start", name))
+    await asyncio.sleep(delay)
+    log.append(("end", name))
+
+async def _process(proc, updates):
+    # Like Application: one task per update, created in arrival order
+    await asyncio.gather(*[proc.process_update(u, c) for u, c in updates])
+
+def test_same_chat_runs_one_at_a_time_in_order():
+    log = []
+    proc = PerChatUpdateProcessor(8)
+    asyncio.run(_process(proc, [
+        (_update(1), _handler(log, "a", 0.05)),
+        (_update(1), _handler(log, "b", 0.0)),
+        (_update(1), _handler(log, "c", 0.01)),
+    ]))
+    assert log == [("start", "a"), ("end", "a"), ("start", "b"), ("end", "b"), ("start", "c"), ("end", "c")]
+    assert proc._queues == {}
+
+def test_different_chats_run_concurrently():
+    log = []
+    proc = PerChatUpdateProcessor(8)
+    asyncio.run(_process(proc, [
+        (_update(1), _handler(log, "a", 0.05)),
+        (_update(2), _handler(log, "b", 0.0)),
+        (_update(None), _handler(log, "c", 0.0)),
+    ]))
+    assert log.index(("end", "b")) < log.index(("end", "a"))
+    assert log.index(("end", "c")) < log.index(("end", "a"))
+
+def test_failed_update_releases_the_chat():
+    log = []
+
+    async def boom():
+        raise RuntimeError("handler failed")
+
+    async def run():
+        proc = PerChatUpdateProcessor(8)
+        first = asyncio.ensure_future(proc.process_update(_update(1), boom()))
+        second = asyncio.ensure_future(proc.process_update(_update(1), _handler(log, "b", 0.0)))
+        results = await asyncio.gather(first, second, return_exceptions=True)
+        return proc, results
+
+    proc, results = asyncio.run(run())
+    assert results == [None, None]
+    assert log == [("start", "b"), ("end", "b")]
+    assert proc._queues == {}
+
+def test_busy_chat_holds_one_slot():
+    log = []
+
+    async def run():
+        proc = PerChatUpdateProcessor(2)
+        updates = [(_update(1), _handler(log, f"a{i}", 0.05)) for i in range(8)]
+        updates.append((_update(2), _handler(log, "b", 0.0)))
+        await _process(proc, updates)
+
+    asyncio.run(run())
+    # Chat 2 got the second slot right away instead of waiting behind chat 1's backlog
+    assert log.index(("end", "b")) < log.index(("end", "a1"))
+    assert [e for e in log if e[1] != "b"] == [(k, f"a{i}") for i in range(8) for k in ("start", "end")]
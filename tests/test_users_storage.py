@@ -0,0 +1,139 @@
+# tests/test_users_storage.py
+import csv
+import io
+import json
+import sqlite3
+import threading
+
+import pytest
+
+import users_db
+import users_manager
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(users_db, "USERS_DB", str(tmp_path / "users.db"))
+    monkeypatch.setattr(users_db, "_local", threading.local())
+    return tmp_path / "users.db"
+
+@pytest.fixture(params=["json", "sqlite"])
+def storage(request, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)   # sessions.invalidate() works relative to the current directory
+    monkeypatch.setattr(users_manager, "USERS_FILE", str(tmp_path / "users.json"))
+    monkeypatch.setattr(users_manager, "USERS_CACHE", False)
+    if request.param == "sqlite":
+        request.getfixturevalue("fresh_db")
+        monkeypatch.setattr(users_manager, "users_db", users_db)
+    else:
+        monkeypatch.setattr(users_manager, "users_db", None)
+    return request.param
+
+def _break_totals(backend: str, chat_id: int):
+    if backend == "sqlite":
+        users_db._connect().execute("UPDATE users SET total_points = total_points + 100 WHERE chat_id = ?", (chat_id,))
+        return
+    with open(users_manager.USERS_FILE, encoding="utf-8") as f:
+        data = json.load(f)
+    data[str(chat_id)]["total_points"] += 100
+    with open(users_manager.USERS_FILE, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+# ----- users_manager, both backends -----
+def test_records_update_totals_and_summary(storage):
+    users_manager.add_or_update_user(1, "a@b.c", "pw")
+    for i in range(7):
+        assert users_manager.add_record(1, f"s{i}", i)
+    s = users_manager.summary(1)
+    assert (s["total_surveys"], s["total_points"]) == (7, 21)
+    assert [r["title"] for r in s["last5"]] == ["s6", "s5", "s4", "s3", "s2"]
+    assert users_manager.summary(2) == {"total_surveys": 0, "total_points": 0, "last5": []}
+
+def test_report_size_does_not_follow_recent_limit(storage, monkeypatch):
+    monkeypatch.setattr(users_manager, "RECENT_LIMIT", 8)
+    for i in range(10):
+        users_manager.add_record(1, f"s{i}", i)
+    assert [r["title"] for r in users_manager.summary(1)["last5"]] == ["s9", "s8", "s7", "s6", "s5"]
+
+def test_record_key_is_idempotent(storage):
+    assert users_manager.add_record(1, "s", 5, key="run1:k")
+    assert not users_manager.add_record(1, "s", 5, key="run1:k")
+    assert users_manager.add_record(1, "s", 5, key="run2:k")
+    assert users_manager.summary(1)["total_points"] == 10
+
+def test_credentials(storage):
+    users_manager.add_record(1, "s", 1)
+    assert users_manager.get_credentials(1) is None
+    assert not users_manager.has_credentials(1)
+    users_manager.add_or_update_user(1, "a@b.c", "pw")
+    assert users_manager.get_credentials(1) == {"email": "a@b.c", "password": "pw"}
+    users_manager.remove_user(1)
+    assert users_manager.get_user(1) is None
+
+def test_history_page_newest_first(storage):
+    for i in range(12):
+        users_manager.add_record(1, f"s{i}", i)
+    page, total = users_manager.history_page(1, 10, 10)
+    assert total == 12
+    assert [r["title"] for r in page] == ["s1", "s0"]
+    assert users_manager.history_page(2, 0, 10) == ([], 0)
+
+def test_aggregate_groups_by_period(storage):
+    for i in range(3):
+        users_manager.add_record(1, f"s{i}", 2)
+    for period in users_manager.PERIOD_FORMATS:
+        rows = users_manager.aggregate(1, period)
+        assert [(r["surveys"], r["points"]) for r in rows] == [(3, 6)]
+
+def test_check_aggregates_finds_and_fixes(storage):
+    users_manager.add_record(1, "s", 3)
+    users_manager.add_record(2, "s", 4)
+    assert users_manager.check_aggregates() == []
+    _break_totals(storage, 2)
+    assert users_manager.check_aggregates(fix=True) == ["2"]
+    assert users_manager.check_aggregates() == []
+    assert users_manager.summary(2)["total_points"] == 4
+
+def test_export_csv_in_batches(storage, monkeypatch):
+    monkeypatch.setattr(users_manager, "EXPORT_BATCH_SIZE", 2)
+    for i in range(5):
+        users_manager.add_record(1, f"s,{i}", i)
+    out = io.BytesIO()
+    assert users_manager.export_csv(1, out) == 5
+    rows = list(csv.reader(io.StringIO(out.getvalue().decode("utf-8"))))
+    assert rows[0] == ["date", "title", "points"]
+    assert [r[1] for r in rows[1:]] == [f"s,{i}" for i in range(5)]
+
+# ----- users_db schema -----
+def test_fresh_db_opened_from_several_threads(fresh_db):
+    errors = []
+    barrier = threading.Barrier(8)
+
+    def first_call(chat_id):
+        barrier.wait()
+        try:
+            users_db.add_record(chat_id, "s", 1)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=first_call, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    conn = sqlite3.connect(fresh_db)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(users_db._MIGRATIONS)
+    assert conn.execute("SELECT COUNT(*), SUM(total_surveys) FROM users").fetchone() == (8, 8)
+
+def test_migration_fills_totals_of_existing_rows(fresh_db):
+    conn = sqlite3.connect(fresh_db)
+    conn.executescript(users_db._SCHEMA)
+    conn.execute("INSERT INTO users (chat_id, email, password) VALUES (1, 'a@b.c', 'pw')")
+    conn.executemany("INSERT INTO stats (chat_id, title, points, date) VALUES (1, ?, ?, '2024-01-01 00:00:00')",
+                     [("a", 2), ("b", 3)])
+    conn.commit()
+    conn.close()
+    s = users_db.summary(1)
+    assert (s["total_surveys"], s["total_points"]) == (2, 5)
+    assert users_db.add_record(1, "c", 1, key="run:k")
+    assert not users_db.add_record(1, "c", 1, key="run:k")
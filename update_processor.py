@@ -0,0 +1,53 @@
+# update_processor.py
+import collections
+import logging
+from typing import Any, Awaitable, Deque, Dict
+
+from telegram.ext import BaseUpdateProcessor
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates of different chats concurrently and those of one chat one at a time, in arrival order.
+
+    ConversationHandler and the menu handlers keep per-chat state, so two updates of the same chat must
+    not interleave. Updates without a chat (none are handled today) are not ordered.
+
+    A chat holds at most one of the max_concurrent_updates slots: an update arriving while its chat is
+    busy is queued and the call returns, freeing its slot; the chat's running update then works through
+    the queue. So one chat tapping a button many times cannot hold up the others.
+    """
+
+    __slots__ = ("_queues",)
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # chat_id -> updates of a busy chat waiting for their turn; absent when the chat is idle
+        self._queues: Dict[int, Deque[Awaitable[Any]]] = {}
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]):
+        chat = getattr(update, "effective_chat", None)
+        if chat is None:
+            await coroutine
+            return
+        queue = self._queues.get(chat.id)
+        if queue is not None:
+            queue.append(coroutine)
+            return
+        queue = self._queues[chat.id] = collections.deque([coroutine])
+        try:
+            while queue:
+                try:
+                    await queue.popleft()
+                except Exception:
+                    # Application.process_update reports handler errors itself; this only keeps the queue going
+                    logging.exception("Processing an update of chat %s failed", chat.id)
+        finally:
+            del self._queues[chat.id]
+            for pending in queue:
+                # Cancelled at shutdown: these never started
+                pending.close()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,227 @@
+# users_db.py
+import json
+import os
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+from typing import Optional, Dict, Any, Iterator, List, Tuple
+
+USERS_DB = os.getenv("USERS_DB", "users.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    chat_id  INTEGER PRIMARY KEY,
+    email    TEXT,
+    password TEXT
+);
+CREATE TABLE IF NOT EXISTS stats (
+    id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    title   TEXT,
+    points  INTEGER NOT NULL DEFAULT 0,
+    date    TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_stats_chat_date ON stats (chat_id, date);
+"""
+
+_AGGREGATES_SQL = """
+UPDATE users SET
+    total_surveys = (SELECT COUNT(*) FROM stats WHERE stats.chat_id = users.chat_id),
+    total_points = (SELECT COALESCE(SUM(points), 0) FROM stats WHERE stats.chat_id = users.chat_id)
+"""
+
+# PRAGMA user_version steps applied on top of _SCHEMA, one statement per item
+# (executescript would commit the migration transaction)
+_MIGRATIONS = [
+    # 1: running totals kept up to date by add_record
+    (
+        "ALTER TABLE users ADD COLUMN total_surveys INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE users ADD COLUMN total_points INTEGER NOT NULL DEFAULT 0",
+        _AGGREGATES_SQL,
+    ),
+    # 2: idempotency key of a record (job_journal.Journal.record_key, unique per run); NULL rows are never equal
+    (
+        "ALTER TABLE stats ADD COLUMN survey_key TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_stats_chat_key ON stats (chat_id, survey_key)",
+    ),
+]
+
+# One connection per thread: sqlite3 connections must not be shared between threads
+_local = threading.local()
+
+def _connect() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(USERS_DB, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _migrate(conn)
+        _local.conn = conn
+    return conn
+
+def _migrate(conn: sqlite3.Connection):
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= len(_MIGRATIONS):
+        return
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        # Read again under the write lock: another thread or process may have migrated in the meantime
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for i, statements in enumerate(_MIGRATIONS[version:], start=version + 1):
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute(f"PRAGMA user_version = {i}")
+
+def _now() -> str:
+    return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+def get_user(chat_id: int) -> Optional[Dict[str, Any]]:
+    conn = _connect()
+    row = conn.execute("SELECT email, password FROM users WHERE chat_id = ?", (chat_id,)).fetchone()
+    if row is None:
+        return None
+    stats = conn.execute(
+        "SELECT title, points, date FROM stats WHERE chat_id = ? ORDER BY date, id", (chat_id,)
+    ).fetchall()
+    return {
+        "email": row["email"],
+        "password": row["password"],
+        "stats": [dict(r) for r in stats]
+    }
+
+def add_or_update_user(chat_id: int, email: str, password: str):
+    conn = _connect()
+    conn.execute(
+        "INSERT INTO users (chat_id, email, password) VALUES (?, ?, ?) "
+        "ON CONFLICT(chat_id) DO UPDATE SET email = excluded.email, password = excluded.password",
+        (chat_id, email, password)
+    )
+
+def remove_user(chat_id: int):
+    conn = _connect()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM stats WHERE chat_id = ?", (chat_id,))
+        conn.execute("DELETE FROM users WHERE chat_id = ?", (chat_id,))
+
+def add_record(chat_id: int, title: str, points: int, key: Optional[str] = None) -> bool:
+    conn = _connect()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("INSERT OR IGNORE INTO users (chat_id, email, password) VALUES (?, NULL, NULL)", (chat_id,))
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO stats (chat_id, title, points, date, survey_key) VALUES (?, ?, ?, ?, ?)",
+            (chat_id, title, points, _now(), key)
+        )
+        if cur.rowcount == 0:
+            return False
+        conn.execute(
+            "UPDATE users SET total_surveys = total_surveys + 1, total_points = total_points + ? WHERE chat_id = ?",
+            (points, chat_id)
+        )
+    return True
+
+def summary(chat_id: int, last: int = 5) -> Dict[str, Any]:
+    conn = _connect()
+    row = conn.execute("SELECT total_surveys, total_points FROM users WHERE chat_id = ?", (chat_id,)).fetchone()
+    if row is None:
+        return {"total_surveys": 0, "total_points": 0, "last5": []}
+    last5 = conn.execute(
+        "SELECT title, points, date FROM stats WHERE chat_id = ? ORDER BY date DESC, id DESC LIMIT ?", (chat_id, last)
+    ).fetchall()
+    return {
+        "total_surveys": row["total_surveys"],
+        "total_points": row["total_points"],
+        "last5": [dict(r) for r in last5]
+    }
+
+def history_page(chat_id: int, offset: int, limit: int) -> Tuple[List[Dict[str, Any]], int]:
+    conn = _connect()
+    row = conn.execute("SELECT total_surveys FROM users WHERE chat_id = ?", (chat_id,)).fetchone()
+    rows = conn.execute(
+        "SELECT title, points, date FROM stats WHERE chat_id = ? ORDER BY date DESC, id DESC LIMIT ? OFFSET ?",
+        (chat_id, limit, offset)
+    ).fetchall()
+    return [dict(r) for r in rows], (row["total_surveys"] if row else 0)
+
+def aggregate(chat_id: int, fmt: str, limit: int) -> List[Dict[str, Any]]:
+    """Surveys and points per strftime(fmt, date) bucket, newest bucket first."""
+    conn = _connect()
+    rows = conn.execute(
+        "SELECT strftime(?, date) AS period, COUNT(*) AS surveys, COALESCE(SUM(points), 0) AS points "
+        "FROM stats WHERE chat_id = ? GROUP BY 1 ORDER BY 1 DESC LIMIT ?",
+        (fmt, chat_id, limit)
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+def iter_records(chat_id: int, batch_size: int) -> Iterator[List[Dict[str, Any]]]:
+    """All records of chat_id, oldest first, batch_size rows per query."""
+    conn = _connect()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, title, points, date FROM stats WHERE chat_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (chat_id, last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            return
+        last_id = rows[-1]["id"]
+        yield [{"title": r["title"], "points": r["points"], "date": r["date"]} for r in rows]
+
+def check_aggregates(fix: bool = False) -> List[str]:
+    conn = _connect()
+    rows = conn.execute(
+        "SELECT u.chat_id FROM users u LEFT JOIN "
+        "(SELECT chat_id, COUNT(*) AS n, SUM(points) AS pts FROM stats GROUP BY chat_id) s ON s.chat_id = u.chat_id "
+        "WHERE u.total_surveys <> COALESCE(s.n, 0) OR u.total_points <> COALESCE(s.pts, 0)"
+    ).fetchall()
+    bad = [str(r["chat_id"]) for r in rows]
+    if fix and bad:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(_AGGREGATES_SQL)
+    return bad
+
+def get_credentials(chat_id: int) -> Optional[Dict[str, str]]:
+    conn = _connect()
+    row = conn.execute(
+        "SELECT email, password FROM users WHERE chat_id = ? AND email <> '' AND password <> ''", (chat_id,)
+    ).fetchone()
+    return {"email": row["email"], "password": row["password"]} if row else None
+
+def has_credentials(chat_id: int) -> bool:
+    conn = _connect()
+    row = conn.execute(
+        "SELECT 1 FROM users WHERE chat_id = ? AND email <> '' AND password <> ''", (chat_id,)
+    ).fetchone()
+    return row is not None
+
+# ----- One-shot migration from users.json -----
+def migrate_from_json(json_path: str = "users.json") -> int:
+    """Import every user and stats entry from json_path, replacing rows for those chats."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    conn = _connect()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for key, u in data.items():
+            chat_id = int(key)
+            conn.execute("DELETE FROM stats WHERE chat_id = ?", (chat_id,))
+            conn.execute(
+                "INSERT OR REPLACE INTO users (chat_id, email, password) VALUES (?, ?, ?)",
+                (chat_id, u.get("email"), u.get("password"))
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO stats (chat_id, title, points, date, survey_key) VALUES (?, ?, ?, ?, ?)",
+                [(chat_id, s.get("title"), s.get("points", 0), s.get("date") or _now(), s.get("key"))
+                 for s in u.get("stats", [])]
+            )
+        conn.execute(_AGGREGATES_SQL)
+    return len(data)
+
+if __name__ == "__main__":
+    src = sys.argv[1] if len(sys.argv) > 1 else "users.json"
+    n = migrate_from_json(src)
+    print(f"Migrated {n} users from {src} into {USERS_DB}")
@@ -1,71 +1,348 @@
 # users_manager.py
+import asyncio
+import atexit
+import copy
+import csv
+import functools
+import io
 import json
+import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, IO, Iterator, List, Tuple
+import metrics
+import sessions
 
 USERS_FILE = "users.json"
+# "json" keeps everything in USERS_FILE, "sqlite" uses users_db (see users_db.py for migration)
+USERS_BACKEND = os.getenv("USERS_BACKEND", "json").lower()
+# JSON backend only: keep the data in memory and write it back at most every USERS_FLUSH_INTERVAL seconds
+USERS_CACHE = os.getenv("USERS_CACHE", "0").lower() in ("1", "true", "yes")
+USERS_FLUSH_INTERVAL = float(os.getenv("USERS_FLUSH_INTERVAL", "2.0"))
+# Newest records listed by the report (summary()["last5"])
+REPORT_ENTRIES = 5
+# Number of newest stats entries mirrored in each user's "recent" buffer; never below REPORT_ENTRIES,
+# since the JSON backend builds the report and checks record keys from this buffer
+RECENT_LIMIT = max(REPORT_ENTRIES, int(os.getenv("USERS_RECENT_LIMIT", "5")))
+# Records fetched (and CSV rows written) per step by export_csv
+EXPORT_BATCH_SIZE = int(os.getenv("USERS_EXPORT_BATCH", "500"))
+# Buckets for aggregate(); the same strftime() patterns work in SQLite
+PERIOD_FORMATS = {"day": "%Y-%m-%d", "week": "%Y-W%W", "month": "%Y-%m"}
+# Threads used by the a* coroutine API below
+USERS_IO_WORKERS = int(os.getenv("USERS_IO_WORKERS", "2"))
 
-def _load() -> Dict[str, Any]:
+if USERS_BACKEND == "sqlite":
+    import users_db
+else:
+    users_db = None
+
+STORAGE_SECONDS = metrics.histogram("bot_users_storage_seconds", "Duration of users_manager reads and writes")
+STORAGE_ERRORS = metrics.counter("bot_users_storage_errors_total", "users_manager calls that raised")
+
+_lock = threading.RLock()
+_cache: Optional[Dict[str, Any]] = None
+_dirty = False
+_flush_timer: Optional[threading.Timer] = None
+
+def _read_file() -> Dict[str, Any]:
     if not os.path.exists(USERS_FILE):
         return {}
     try:
         with open(USERS_FILE, "r", encoding="utf-8") as f:
             return json.load(f)
-    except:
+    except ValueError:
+        # Keep the broken file for inspection instead of overwriting it on the next save
+        broken = f"{USERS_FILE}.corrupt-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
+        os.replace(USERS_FILE, broken)
+        logging.error("%s is not valid JSON, moved to %s", USERS_FILE, broken)
         return {}
 
-def _save(data: Dict[str, Any]):
-    with open(USERS_FILE, "w", encoding="utf-8") as f:
+def _write_file(data: Dict[str, Any]):
+    tmp = f"{USERS_FILE}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, USERS_FILE)
+
+def _load() -> Dict[str, Any]:
+    global _cache
+    if not USERS_CACHE:
+        return _read_file()
+    with _lock:
+        if _cache is None:
+            _cache = _read_file()
+        return _cache
+
+def _save(data: Dict[str, Any]):
+    global _dirty, _flush_timer
+    if not USERS_CACHE:
+        _write_file(data)
+        return
+    with _lock:
+        _dirty = True
+        if _flush_timer is None:
+            _flush_timer = threading.Timer(USERS_FLUSH_INTERVAL, flush)
+            _flush_timer.daemon = True
+            _flush_timer.start()
+
+def flush():
+    """Write pending cached changes to USERS_FILE right away (no-op when nothing is dirty)."""
+    global _dirty, _flush_timer
+    with _lock:
+        if _flush_timer is not None:
+            _flush_timer.cancel()
+            _flush_timer = None
+        if _dirty and _cache is not None:
+            _write_file(_cache)
+            _dirty = False
+
+atexit.register(flush)
 
+@metrics.timed(STORAGE_SECONDS, STORAGE_ERRORS, op="read", fn="get_user")
 def get_user(chat_id: int) -> Optional[Dict[str, Any]]:
-    data = _load()
-    return data.get(str(chat_id))
+    if users_db:
+        return users_db.get_user(chat_id)
+    with _lock:
+        u = _load().get(str(chat_id))
+        # In cached mode u is the live cache entry; callers (and other threads) must not share it
+        return copy.deepcopy(u) if u is not None else None
 
+def _rebuild(u: Dict[str, Any]):
+    stats = u.get("stats", [])
+    u["total_surveys"] = len(stats)
+    u["total_points"] = sum(r.get("points", 0) for r in stats)
+    u["recent"] = stats[-RECENT_LIMIT:]
+
+def _aggregates_ok(u: Dict[str, Any]) -> bool:
+    stats = u.get("stats", [])
+    return (
+        u.get("total_surveys") == len(stats)
+        and u.get("total_points") == sum(r.get("points", 0) for r in stats)
+        and u.get("recent") == stats[-RECENT_LIMIT:]
+    )
+
+@metrics.timed(STORAGE_SECONDS, STORAGE_ERRORS, op="write", fn="add_or_update_user")
 def add_or_update_user(chat_id: int, email: str, password: str):
-    data = _load()
-    u = data.get(str(chat_id), {})
-    u["email"] = email
-    u["password"] = password
-    if "stats" not in u:
-        u["stats"] = []
-    data[str(chat_id)] = u
-    _save(data)
+    # The saved browser session belongs to the previous credentials
+    sessions.invalidate(chat_id)
+    if users_db:
+        return users_db.add_or_update_user(chat_id, email, password)
+    with _lock:
+        data = _load()
+        u = data.get(str(chat_id), {})
+        u["email"] = email
+        u["password"] = password
+        if "stats" not in u:
+            u["stats"] = []
+        if "total_surveys" not in u:
+            _rebuild(u)
+        data[str(chat_id)] = u
+        _save(data)
 
+@metrics.timed(STORAGE_SECONDS, STORAGE_ERRORS, op="write", fn="remove_user")
 def remove_user(chat_id: int):
-    data = _load()
-    if str(chat_id) in data:
-        data.pop(str(chat_id))
-        _save(data)
+    sessions.invalidate(chat_id)
+    if users_db:
+        return users_db.remove_user(chat_id)
+    with _lock:
+        data = _load()
+        if str(chat_id) in data:
+            data.pop(str(chat_id))
+            _save(data)
 
-def add_record(chat_id: int, title: str, points: int):
-    data = _load()
-    key = str(chat_id)
-    if key not in data:
-        data[key] = {"email": None, "password": None, "stats": []}
-    stats = data[key].get("stats", [])
-    stats.append({
-        "title": title,
-        "points": points,
-        "date": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-    })
-    data[key]["stats"] = stats
-    _save(data)
+@metrics.timed(STORAGE_SECONDS, STORAGE_ERRORS, op="write", fn="add_record")
+def add_record(chat_id: int, title: str, points: int, key: Optional[str] = None) -> bool:
+    """Append a completed survey; with a key (Journal.record_key) a repeat is ignored and False returned."""
+    if users_db:
+        return users_db.add_record(chat_id, title, points, key)
+    with _lock:
+        data = _load()
+        if str(chat_id) not in data:
+            data[str(chat_id)] = {"email": None, "password": None, "stats": []}
+        u = data[str(chat_id)]
+        if "total_surveys" not in u:
+            _rebuild(u)
+        # A repeat can only come from the same run being resumed, right after the original record,
+        # so the recent buffer is enough and add_record stays O(RECENT_LIMIT)
+        if key is not None and any(r.get("key") == key for r in u["recent"]):
+            return False
+        record = {
+            "title": title,
+            "points": points,
+            "date": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        if key is not None:
+            record["key"] = key
+        u.setdefault("stats", []).append(record)
+        u["total_surveys"] += 1
+        u["total_points"] += points
+        recent = u["recent"]
+        recent.append(record)
+        if len(recent) > RECENT_LIMIT:
+            del recent[:len(recent) - RECENT_LIMIT]
+        _save(data)
+        return True
 
+@metrics.timed(STORAGE_SECONDS, STORAGE_ERRORS, op="read", fn="summary")
 def summary(chat_id: int) -> Dict[str, any]:
-    data = _load()
-    u = data.get(str(chat_id), {})
-    stats = u.get("stats", [])
-    total_surveys = len(stats)
-    total_points = sum(s.get("points", 0) for s in stats)
-    last5 = list(reversed(stats))[:5]
-    return {
-        "total_surveys": total_surveys,
-        "total_points": total_points,
-        "last5": last5
-    }
+    if users_db:
+        return users_db.summary(chat_id, REPORT_ENTRIES)
+    with _lock:
+        data = _load()
+        u = data.get(str(chat_id))
+        if u is None:
+            return {"total_surveys": 0, "total_points": 0, "last5": []}
+        if "total_surveys" not in u:
+            # Record written before aggregates existed
+            _rebuild(u)
+            _save(data)
+        return {
+            "total_surveys": u["total_surveys"],
+            "total_points": u["total_points"],
+            "last5": list(reversed(u["recent"][-REPORT_ENTRIES:]))
+        }
+
+@metrics.timed(STORAGE_SECONDS, STORAGE_ERRORS, op="read", fn="history_page")
+def history_page(chat_id: int, offset: int = 0, limit: int = 10) -> Tuple[List[Dict[str, Any]], int]:
+    """Records newest first, skipping offset of them, and the total number of records."""
+    if users_db:
+        return users_db.history_page(chat_id, offset, limit)
+    with _lock:
+        stats = _load().get(str(chat_id), {}).get("stats", [])
+        end = max(0, len(stats) - offset)
+        page = stats[max(0, end - limit):end]
+        return [dict(r) for r in reversed(page)], len(stats)
+
+@metrics.timed(STORAGE_SECONDS, STORAGE_ERRORS, op="read", fn="aggregate")
+def aggregate(chat_id: int, period: str = "day", limit: int = 10) -> List[Dict[str, Any]]:
+    """Surveys and points per day / week / month, newest first, at most limit buckets."""
+    fmt = PERIOD_FORMATS[period]
+    if users_db:
+        return users_db.aggregate(chat_id, fmt, limit)
+    buckets: Dict[str, Dict[str, Any]] = {}
+    with _lock:
+        for r in _load().get(str(chat_id), {}).get("stats", []):
+            try:
+                name = datetime.strptime(r.get("date", ""), "%Y-%m-%d %H:%M:%S").strftime(fmt)
+            except ValueError:
+                continue
+            b = buckets.setdefault(name, {"period": name, "surveys": 0, "points": 0})
+            b["surveys"] += 1
+            b["points"] += r.get("points", 0)
+    return [buckets[k] for k in sorted(buckets, reverse=True)[:limit]]
 
+def _iter_records(chat_id: int, batch_size: int) -> Iterator[List[Dict[str, Any]]]:
+    if users_db:
+        yield from users_db.iter_records(chat_id, batch_size)
+        return
+    stats = _load().get(str(chat_id), {}).get("stats", [])
+    for i in range(0, len(stats), batch_size):
+        with _lock:
+            # The cached list only ever grows at the end, so slicing it batch by batch is safe
+            batch = [dict(r) for r in stats[i:i + batch_size]]
+        yield batch
+
+@metrics.timed(STORAGE_SECONDS, STORAGE_ERRORS, op="read", fn="export_csv")
+def export_csv(chat_id: int, out: IO[bytes]) -> int:
+    """Write all records of chat_id to the binary file out as UTF-8 CSV, one batch at a time; returns the row count."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(["date", "title", "points"])
+    rows = 0
+    for batch in _iter_records(chat_id, EXPORT_BATCH_SIZE):
+        writer.writerows((r.get("date"), r.get("title"), r.get("points", 0)) for r in batch)
+        rows += len(batch)
+        out.write(buf.getvalue().encode("utf-8"))
+        buf.seek(0)
+        buf.truncate()
+    out.write(buf.getvalue().encode("utf-8"))
+    return rows
+
+@metrics.timed(STORAGE_SECONDS, STORAGE_ERRORS, op="read", fn="check_aggregates")
+def check_aggregates(fix: bool = False) -> List[str]:
+    """Compare stored totals/recent buffers with the raw stats history.
+
+    Returns the chat ids whose aggregates were out of date; with fix=True they are rebuilt and saved.
+    """
+    if users_db:
+        return users_db.check_aggregates(fix)
+    with _lock:
+        data = _load()
+        bad = [key for key, u in data.items() if not _aggregates_ok(u)]
+        if fix and bad:
+            for key in bad:
+                _rebuild(data[key])
+            _save(data)
+        return bad
+
+@metrics.timed(STORAGE_SECONDS, STORAGE_ERRORS, op="read", fn="get_credentials")
+def get_credentials(chat_id: int) -> Optional[Dict[str, str]]:
+    """{"email", "password"} without the stats history, or None when the account is incomplete."""
+    if users_db:
+        return users_db.get_credentials(chat_id)
+    with _lock:
+        u = _load().get(str(chat_id))
+        if not (u and u.get("email") and u.get("password")):
+            return None
+        return {"email": u["email"], "password": u["password"]}
+
+@metrics.timed(STORAGE_SECONDS, STORAGE_ERRORS, op="read", fn="has_credentials")
 def has_credentials(chat_id: int) -> bool:
-    u = get_user(chat_id)
-    return bool(u and u.get("email") and u.get("password"))
+    if users_db:
+        return users_db.has_credentials(chat_id)
+    return get_credentials(chat_id) is not None
+
+# ----- Async API: storage work runs on a dedicated executor, never on the event loop -----
+_executor: Optional[ThreadPoolExecutor] = None
+_write_locks: Dict[int, asyncio.Lock] = {}   # chat_id -> lock serializing that user's writes
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=USERS_IO_WORKERS, thread_name_prefix="users-io")
+    return _executor
+
+async def _run(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(fn, *args))
+
+async def _run_write(chat_id: int, fn, *args):
+    lock = _write_locks.setdefault(chat_id, asyncio.Lock())
+    async with lock:
+        return await _run(fn, chat_id, *args)
+
+async def aget_user(chat_id: int) -> Optional[Dict[str, Any]]:
+    return await _run(get_user, chat_id)
+
+async def aget_credentials(chat_id: int) -> Optional[Dict[str, str]]:
+    return await _run(get_credentials, chat_id)
+
+async def ahas_credentials(chat_id: int) -> bool:
+    return await _run(has_credentials, chat_id)
+
+async def asummary(chat_id: int) -> Dict[str, Any]:
+    return await _run(summary, chat_id)
+
+async def aadd_or_update_user(chat_id: int, email: str, password: str):
+    return await _run_write(chat_id, add_or_update_user, email, password)
+
+async def aremove_user(chat_id: int):
+    return await _run_write(chat_id, remove_user)
+
+async def aadd_record(chat_id: int, title: str, points: int, key: Optional[str] = None) -> bool:
+    return await _run_write(chat_id, add_record, title, points, key)
+
+async def ahistory_page(chat_id: int, offset: int = 0, limit: int = 10) -> Tuple[List[Dict[str, Any]], int]:
+    return await _run(history_page, chat_id, offset, limit)
+
+async def aaggregate(chat_id: int, period: str = "day", limit: int = 10) -> List[Dict[str, Any]]:
+    return await _run(aggregate, chat_id, period, limit)
+
+async def aexport_csv(chat_id: int, out: IO[bytes]) -> int:
+    return await _run(export_csv, chat_id, out)
+
+async def aflush():
+    await _run(flush)
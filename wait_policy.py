@@ -0,0 +1,82 @@
+# wait_policy.py
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from typing import Awaitable, Dict, List, Optional
+
+class WaitPolicy:
+    """Timeouts (ms) for each readiness wait; WAIT_<STEP>_MS env vars override the defaults."""
+
+    DEFAULTS = {
+        "surveys_list": 15000,   # survey buttons visible or network idle on SURVEYS_URL
+        "survey_open": 15000,    # navigation / popup / frame after clicking a survey button
+        "page_load": 10000,      # "load" state of the opened survey page
+        "captcha_appear": 2000,  # late captcha frame after the page loaded; ends early once the network is idle
+        "after_captcha": 5000,   # network idle after the user solved the captcha
+    }
+
+    def __init__(self, **overrides: float):
+        self.timeouts = {
+            step: float(os.getenv(f"WAIT_{step.upper()}_MS", default))
+            for step, default in self.DEFAULTS.items()
+        }
+        self.timeouts.update(overrides)
+
+    def timeout(self, step: str) -> float:
+        return self.timeouts[step]
+
+class StepTimings:
+    """Time actually spent in each named wait, so latency can be attributed per step."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+
+    def record(self, step: str, seconds: float):
+        self.samples.setdefault(step, []).append(seconds)
+
+    @contextlib.contextmanager
+    def step(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            step: {"count": len(v), "total": round(sum(v), 3), "max": round(max(v), 3)}
+            for step, v in self.samples.items()
+        }
+
+async def first_of(*aws: Awaitable, timeout: float) -> Optional[int]:
+    """Await whichever awaitable finishes first (timeout in ms).
+
+    Returns its position, or None when nothing completed in time; the others are cancelled.
+    Awaitables that fail are ignored as long as another one may still succeed.
+    """
+    tasks = [asyncio.ensure_future(a) for a in aws]
+    pending = set(tasks)
+    winner = None
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout / 1000
+    try:
+        while pending and winner is None:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if not t.cancelled() and t.exception() is None:
+                    winner = tasks.index(t)
+                    break
+                if not t.cancelled():
+                    logging.debug("Wait condition failed: %s", t.exception())
+    finally:
+        for t in pending:
+            t.cancel()
+        for t in pending:
+            with contextlib.suppress(BaseException):
+                await t
+    return winner
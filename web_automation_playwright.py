@@ -1,46 +1,201 @@
 # web_automation_playwright.py
 import asyncio
+import hashlib
 import logging
+import os
+import re
+import time
 from typing import List, Dict, Optional
-from playwright.async_api import async_playwright, Page
+from urllib.parse import urlparse
+from bs4 import BeautifulSoup
+from playwright.async_api import Page
+import browser_pool
+import metrics
+import sessions
+from captcha_detector import CaptchaDetector
+from request_policy import RequestPolicy
+from wait_policy import WaitPolicy, StepTimings, first_of
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
+SURVEY_BUTTON_TEXT = "Пройти опрос"
+SURVEY_BUTTON_XPATH = f"//button[contains(text(), '{SURVEY_BUTTON_TEXT}')]"
+POINTS_RE = re.compile(r"(\d+)\s*балл")
+DURATION_RE = re.compile(r"(\d+)\s*минут")
+
+CAPTCHA_JPEG_QUALITY = int(os.getenv("CAPTCHA_JPEG_QUALITY", "70"))
+CAPTCHA_MIN_QUALITY = 25
+CAPTCHA_MAX_BYTES = int(os.getenv("CAPTCHA_MAX_BYTES", str(300 * 1024)))
+CAPTCHA_CLIP_PADDING = 40  # px around the captcha frames, so the user sees some context
+
+PLAYWRIGHT_SECONDS = metrics.histogram("bot_playwright_seconds", "Duration of PlaywrightExpertBot operations")
+PLAYWRIGHT_ERRORS = metrics.counter("bot_playwright_errors_total", "PlaywrightExpertBot operations that raised")
+LOGINS = metrics.counter("bot_logins_total", "login() outcomes by method (session/form) and result")
+SNAPSHOT_SECONDS = metrics.histogram("bot_captcha_snapshot_seconds", "Time to shoot and re-encode one captcha JPEG")
+SNAPSHOT_BYTES = metrics.histogram(
+    "bot_captcha_snapshot_bytes", "Size of the captcha JPEG sent to the user",
+    buckets=(10e3, 25e3, 50e3, 100e3, 200e3, 300e3, 500e3, 1e6),
+)
+
+def _xpath_literal(value: str) -> str:
+    if "'" not in value:
+        return f"'{value}'"
+    if '"' not in value:
+        return f'"{value}"'
+    parts = value.split("'")
+    return "concat(" + ", \"'\", ".join(f"'{p}'" for p in parts) + ")"
+
+def _normalize_space(text: str) -> str:
+    # XPath normalize-space(): only space, tab, CR and LF count as whitespace (not NBSP)
+    return " ".join(re.split(r"[ \t\r\n]+", text.strip(" \t\r\n")))
+
+def _is_card(tag) -> bool:
+    # Same test as the XPath contains(@class, 'card') on the raw attribute
+    return tag.name == "div" and "card" in " ".join(tag.get("class", []))
+
+def _is_survey_button(tag) -> bool:
+    # Mirrors //button[contains(text(), ...)]: only the first direct text node counts
+    if tag.name != "button":
+        return False
+    first_text = tag.find(string=True, recursive=False)
+    return bool(first_text) and SURVEY_BUTTON_TEXT in first_text
+
+def parse_surveys(html: str) -> List[Dict]:
+    """Extract survey cards (title, points, duration, button locator) from the surveys page HTML."""
+    soup = BeautifulSoup(html, "html.parser")
+    parsed = []
+    for i, btn in enumerate(soup.find_all(_is_survey_button)):
+        card = btn.find_parent(_is_card)
+        if card is None:
+            logging.warning("Survey button %d has no card container, skipping", i + 1)
+            continue
+        title_el = card.find("h5")
+        if title_el is not None:
+            # Same string as normalize-space() of the h5 in the anchored XPath: inline tags add no spaces
+            title = _normalize_space(title_el.get_text())
+        else:
+            title = " ".join(card.get_text(" ").split())
+        text = card.get_text(" ")
+        points_match = POINTS_RE.search(text)
+        duration_match = DURATION_RE.search(text)
+        parsed.append({
+            "index": i,
+            "title": title or "Опрос",
+            "points": int(points_match.group(1)) if points_match else 0,
+            "duration": duration_match.group(1) if duration_match else "N/A",
+            "has_h5": title_el is not None,
+        })
+
+    titles = [p["title"] for p in parsed]
+    surveys = []
+    for p in parsed:
+        if p.pop("has_h5") and titles.count(p["title"]) == 1:
+            # Anchored on the card title, so it still hits the right button if cards move
+            p["button_xpath"] = (
+                f"{SURVEY_BUTTON_XPATH}[ancestor::div[contains(@class, 'card')][1][.//h5[normalize-space()={_xpath_literal(p['title'])}]]]"
+            )
+        else:
+            p["button_xpath"] = f"({SURVEY_BUTTON_XPATH})[{p['index'] + 1}]"
+        surveys.append(p)
+    return surveys
+
 class PlaywrightExpertBot:
-    LOGIN_URL = "https://panel.expertnoemnenie.ru/login"
-    SURVEYS_URL = "https://panel.expertnoemnenie.ru/surveys"
+    # Overridable so the bot can be pointed at a local stand-in (see bench/)
+    LOGIN_URL = os.getenv("PANEL_LOGIN_URL", "https://panel.expertnoemnenie.ru/login")
+    SURVEYS_URL = os.getenv("PANEL_SURVEYS_URL", "https://panel.expertnoemnenie.ru/surveys")
 
-    def __init__(self, email: str, password: str, headless: bool = True):
+    def __init__(self, email: str, password: str, headless: bool = True, session_key: Optional[str] = None):
         self.email = email
         self.password = password
         self.browser = None
         self.context = None
         self.page: Optional[Page] = None
-        self.playwright = None
+        self.pool = None
         self.headless = headless
+        # Key under which the pooled BrowserContext is kept between runs (e.g. the chat id)
+        self.session_key = session_key
+        # Survey opened in a popup window; None when surveys open in self.page
+        self.survey_page: Optional[Page] = None
+        self.waits = WaitPolicy()
+        self.timings = StepTimings()
+        self.captcha = CaptchaDetector()
+        self.requests = RequestPolicy()
+        self.last_snapshot: Optional[Dict] = None
+        # login() left self.page on a freshly loaded SURVEYS_URL, so open_surveys_page can skip one goto
+        self._surveys_loaded = False
 
+    @property
+    def active_page(self) -> Optional[Page]:
+        return self.survey_page or self.page
+
+    def _pool_key(self) -> Optional[str]:
+        if self.session_key is None:
+            return None
+        # A pooled context holds the cookies of one account, so new credentials must not reuse it
+        digest = hashlib.sha256(f"{self.email}\0{self.password}".encode("utf-8")).hexdigest()[:12]
+        return f"{self.session_key}:{digest}"
+
+    @metrics.timed(PLAYWRIGHT_SECONDS, PLAYWRIGHT_ERRORS, op="start")
     async def start(self):
-        self.playwright = await async_playwright().start()
-        self.browser = await self.playwright.chromium.launch(headless=self.headless, args=["--no-sandbox"])
-        self.context = await self.browser.new_context(viewport={"width":1280, "height":800})
+        self.pool = browser_pool.get_pool(headless=self.headless)
+        state = sessions.load_path(self.session_key) if self.session_key else None
+        self.context = await self.pool.lease(self._pool_key(), viewport={"width":1280, "height":800}, storage_state=state)
+        self.browser = self.context.browser
+        await self.requests.attach(self.context)
         self.page = await self.context.new_page()
-        logging.info("Playwright started")
+        self.captcha.attach(self.page)
+        logging.info("Browser context leased (key=%s, saved session=%s)", self.session_key, bool(state))
 
     async def stop(self):
+        if self.timings.samples:
+            logging.info("Wait timings (key=%s): %s", self.session_key, self.timings.summary())
+        if self.requests.stats.allowed or self.requests.stats.blocked:
+            logging.info("Requests (key=%s): %s", self.session_key, self.requests.stats.summary())
+        self.captcha.detach()
         try:
+            if self.survey_page:
+                await self.survey_page.close()
+            if self.page:
+                await self.page.close()
+            await self.requests.detach()
             if self.context:
-                await self.context.close()
-            if self.browser:
-                await self.browser.close()
-            if self.playwright:
-                await self.playwright.stop()
+                await self.pool.release(self.context, self._pool_key())
         except Exception as e:
             logging.warning("Error stopping playwright: %s", e)
+        finally:
+            self.page = None
+            self.survey_page = None
+            self._surveys_loaded = False
+            self.context = None
+            self.browser = None
 
+    async def _session_valid(self) -> bool:
+        """True when the context's cookies still get us to the surveys page without a login redirect."""
+        if not await self.context.cookies():
+            return False
+        # The same lean load as open_surveys_page, which then reuses this page instead of loading it again
+        self.requests.restrict_page(self.page)
+        try:
+            await self.page.goto(self.SURVEYS_URL, wait_until="domcontentloaded")
+        except Exception as e:
+            logging.warning("Session check failed: %s", e)
+            return False
+        return "/surveys" in urlparse(self.page.url).path
+
+    @metrics.timed(PLAYWRIGHT_SECONDS, PLAYWRIGHT_ERRORS, op="login")
     async def login(self) -> bool:
         if not self.page:
             await self.start()
 
+        if self.session_key and await self._session_valid():
+            logging.info("Reusing saved session, current url: %s", self.page.url)
+            self._surveys_loaded = True
+            LOGINS.inc(method="session", result="ok")
+            return True
+        if self.session_key:
+            sessions.invalidate(self.session_key)
+            await self.context.clear_cookies()
+
         logging.info("Navigating to login page")
         await self.page.goto(self.LOGIN_URL, wait_until="domcontentloaded")
         try:
@@ -48,117 +203,176 @@ class PlaywrightExpertBot:
             await self.page.fill('input[name="email"]', self.email)
             await self.page.fill('input[name="password"]', self.password)
             await self.page.click("//button[contains(text(), 'Войти')]")
-            await self.page.wait_for_url(lambda url: "/surveys" in url.path, timeout=20000)
+            await self.page.wait_for_url(lambda url: "/surveys" in urlparse(url).path, timeout=20000)
             logging.info("Login successful, current url: %s", self.page.url)
-            return True
         except Exception as e:
             logging.error("Login failed: %s", e, exc_info=True)
+            LOGINS.inc(method="form", result="failed")
             return False
+        LOGINS.inc(method="form", result="ok")
+        self._surveys_loaded = True
+        if self.session_key:
+            try:
+                sessions.save(self.session_key, await self.context.storage_state())
+            except Exception as e:
+                logging.warning("Could not save session: %s", e)
+        return True
 
-    async def get_available_surveys(self) -> List[Dict]:
+    async def _close_survey_page(self):
+        if self.survey_page:
+            try:
+                await self.survey_page.close()
+            except Exception as e:
+                logging.warning("Error closing survey popup: %s", e)
+            self.survey_page = None
+
+    async def open_surveys_page(self):
         if not self.page:
             raise RuntimeError("Playwright page not started")
+        await self._close_survey_page()
+        self.requests.restrict_page(self.page)
+        fresh, self._surveys_loaded = self._surveys_loaded, False
+        with self.timings.step("surveys_list"):
+            if not (fresh and urlparse(self.page.url).path == urlparse(self.SURVEYS_URL).path):
+                await self.page.goto(self.SURVEYS_URL, wait_until="domcontentloaded")
+            # Ready as soon as a survey button shows up; an empty list is ready once the network settles
+            ready = await first_of(
+                self.page.wait_for_selector(SURVEY_BUTTON_XPATH, state="visible", timeout=0),
+                self.page.wait_for_load_state("networkidle", timeout=0),
+                timeout=self.waits.timeout("surveys_list"),
+            )
+        if ready is None:
+            logging.warning("Surveys page not ready after %d ms, parsing what is there", self.waits.timeout("surveys_list"))
 
-        await self.page.goto(self.SURVEYS_URL, wait_until="networkidle")
-        await asyncio.sleep(2)
-
-        surveys = []
+    @metrics.timed(PLAYWRIGHT_SECONDS, PLAYWRIGHT_ERRORS, op="get_available_surveys")
+    async def get_available_surveys(self) -> List[Dict]:
+        await self.open_surveys_page()
         try:
-            buttons = await self.page.locator("//button[contains(text(), 'Пройти опрос')]").all()
-            if not buttons:
-                logging.info("No 'Пройти опрос' buttons found")
-                return surveys
-
-            for i, btn in enumerate(buttons):
-                try:
-                    card = btn.locator("xpath=ancestor::div[contains(@class, 'card')][1]")
-                    title_el = card.locator(".//h5")
-                    title = (await title_el.inner_text()) if await title_el.count() else await card.inner_text()
-                    text = await card.inner_text()
-                    import re
-                    points_match = re.search(r"(\d+)\s*балл", text)
-                    duration_match = re.search(r"(\d+)\s*минут", text)
-                    points = int(points_match.group(1)) if points_match else 0
-                    duration = duration_match.group(1) if duration_match else "N/A"
-                    xpath_btn = f"(//button[contains(text(), 'Пройти опрос')])[{i+1}]"
-
-                    surveys.append({
-                        "index": i,
-                        "title": title.strip() if isinstance(title, str) else "Опрос",
-                        "points": points,
-                        "duration": duration,
-                        "button_xpath": xpath_btn
-                    })
-                except Exception as e:
-                    logging.warning("Error parsing survey card: %s", e)
-                    continue
-
-            return surveys
+            # One round trip for the whole page instead of several per card
+            surveys = parse_surveys(await self.page.content())
         except Exception as e:
             logging.error("Error getting surveys: %s", e, exc_info=True)
-            return surveys
+            return []
+        if not surveys:
+            logging.info("No 'Пройти опрос' buttons found")
+        return surveys
 
+    @metrics.timed(PLAYWRIGHT_SECONDS, PLAYWRIGHT_ERRORS, op="open_survey_by_xpath")
     async def open_survey_by_xpath(self, button_xpath: str) -> bool:
         if not self.page:
             raise RuntimeError("page not started")
         try:
+            if self.survey_page or urlparse(self.page.url).path != urlparse(self.SURVEYS_URL).path:
+                # The previous survey navigated away from (or opened on top of) the list
+                await self.open_surveys_page()
             logging.info("Clicking survey button: %s", button_xpath)
-            await self.page.click(button_xpath)
-            await asyncio.sleep(2)
+            self._surveys_loaded = False
+            before = self.page.url
+            # The survey itself (here, in a frame or in a popup) loads with images and fonts
+            self.requests.allow_page(self.page)
+            popup = asyncio.ensure_future(self.page.wait_for_event("popup", timeout=0))
+            try:
+                await self.page.click(button_xpath)
+            except Exception:
+                popup.cancel()
+                raise
+            with self.timings.step("survey_open"):
+                # A survey either opens in a new window, navigates this tab or is embedded in a frame
+                opened = await first_of(
+                    popup,
+                    self.page.wait_for_url(lambda url: url != before, wait_until="domcontentloaded", timeout=0),
+                    self.page.wait_for_event("frameattached", timeout=0),
+                    timeout=self.waits.timeout("survey_open"),
+                )
+            if opened == 0:
+                self.survey_page = popup.result()
+                self.captcha.attach(self.survey_page)
+            elif opened is None:
+                logging.warning("Nothing happened %d ms after clicking %s", self.waits.timeout("survey_open"), button_xpath)
+            with self.timings.step("page_load"):
+                await self.active_page.wait_for_load_state("load", timeout=self.waits.timeout("page_load"))
             return True
         except Exception as e:
             logging.error("Error clicking survey button: %s", e, exc_info=True)
             return False
 
+    @metrics.timed(PLAYWRIGHT_SECONDS, PLAYWRIGHT_ERRORS, op="check_captcha")
     async def check_captcha(self) -> bool:
-        if not self.page:
-            return False
-        try:
-            frames = self.page.frames
-            for f in frames:
-                src = f.url or ""
-                if "recaptcha" in src or "google.com/recaptcha" in src:
-                    logging.info("Detected reCAPTCHA iframe: %s", src)
-                    return True
-            iframe_count = await self.page.locator("iframe").count()
-            for i in range(iframe_count):
-                src = await self.page.locator("iframe").nth(i).get_attribute("src")
-                title = await self.page.locator("iframe").nth(i).get_attribute("title")
-                if src and "recaptcha" in src:
-                    logging.info("Detected recaptcha src iframe")
-                    return True
-                if title and "recaptcha" in title.lower():
-                    logging.info("Detected recaptcha title iframe")
-                    return True
-            return False
-        except Exception as e:
-            logging.warning("Error checking captcha: %s", e)
-            return False
+        return self.captcha.present
 
-    async def screenshot_captcha(self, path: str) -> str:
-        if not self.page:
+    async def wait_for_captcha(self) -> bool:
+        """True when the opened survey shows a captcha.
+
+        Returns as soon as a captcha frame attaches or the page's network goes idle (no captcha coming),
+        at the latest after the "captcha_appear" timeout.
+        """
+        timeout = self.waits.timeout("captcha_appear")
+        with self.timings.step("captcha_appear"):
+            await first_of(
+                self.captcha.wait(timeout),
+                self.active_page.wait_for_load_state("networkidle", timeout=0),
+                timeout=timeout,
+            )
+        return self.captcha.present
+
+    async def _captcha_clip(self) -> Optional[Dict[str, float]]:
+        """Union of the visible captcha frames' boxes (plus padding), or None to shoot the viewport."""
+        boxes = []
+        for frame in self.captcha.frames:
+            try:
+                box = await (await frame.frame_element()).bounding_box()
+            except Exception:
+                continue
+            if box and box["width"] > 1 and box["height"] > 1:
+                boxes.append(box)
+        if not boxes:
+            return None
+        x0 = max(0, min(b["x"] for b in boxes) - CAPTCHA_CLIP_PADDING)
+        y0 = max(0, min(b["y"] for b in boxes) - CAPTCHA_CLIP_PADDING)
+        x1 = max(b["x"] + b["width"] for b in boxes) + CAPTCHA_CLIP_PADDING
+        y1 = max(b["y"] + b["height"] for b in boxes) + CAPTCHA_CLIP_PADDING
+        return {"x": x0, "y": y0, "width": x1 - x0, "height": y1 - y0}
+
+    async def screenshot_captcha(self) -> bytes:
+        """JPEG of the captcha area kept in memory, re-encoded at lower quality until under CAPTCHA_MAX_BYTES."""
+        page = self.active_page
+        if not page:
             raise RuntimeError("page not started")
-        try:
-            iframe_locator = self.page.locator("iframe")
-            count = await iframe_locator.count()
-            for i in range(count):
-                src = await iframe_locator.nth(i).get_attribute("src") or ""
-                title = await iframe_locator.nth(i).get_attribute("title") or ""
-                if "recaptcha" in src or "recaptcha" in title.lower():
-                    await self.page.screenshot(path=path, full_page=True)
-                    return path
-            await self.page.screenshot(path=path, full_page=True)
-            return path
-        except Exception as e:
-            logging.error("Error making captcha screenshot: %s", e, exc_info=True)
-            await self.page.screenshot(path=path, full_page=True)
-            return path
+        started = time.perf_counter()
+        clip = await self._captcha_clip()
+        quality = CAPTCHA_JPEG_QUALITY
+        while True:
+            try:
+                data = await page.screenshot(type="jpeg", quality=quality, clip=clip)
+            except Exception as e:
+                if clip is None:
+                    raise
+                # The frame moved or scrolled out of the viewport between measuring and shooting
+                logging.warning("Clipped captcha screenshot failed (%s), using the viewport", e)
+                clip = None
+                continue
+            if len(data) <= CAPTCHA_MAX_BYTES or quality <= CAPTCHA_MIN_QUALITY:
+                break
+            quality = max(CAPTCHA_MIN_QUALITY, quality - 15)
+        elapsed = time.perf_counter() - started
+        self.timings.record("captcha_snapshot", elapsed)
+        self.last_snapshot = {
+            "encode_ms": round(elapsed * 1000, 1),
+            "bytes": len(data),
+            "quality": quality,
+            "clipped": clip is not None,
+        }
+        SNAPSHOT_SECONDS.observe(elapsed, clipped=str(clip is not None).lower())
+        SNAPSHOT_BYTES.observe(len(data), clipped=str(clip is not None).lower())
+        logging.info("Captcha snapshot: %s", self.last_snapshot)
+        return data
 
     async def continue_after_captcha(self) -> bool:
-        if not self.page:
+        if not self.active_page:
             raise RuntimeError("page not started")
         try:
-            await self.page.wait_for_timeout(1500)
+            with self.timings.step("after_captcha"):
+                await self.active_page.wait_for_load_state("networkidle", timeout=self.waits.timeout("after_captcha"))
             return True
         except Exception as e:
             logging.warning("Continue after captcha error: %s", e)